@@ -3,18 +3,40 @@
 #----------------------------------------------------------------------------#
 
 import json
+import re
+import csv
+import io
+import zlib
+import time
+import base64
+import random
+import hashlib
+import click
 import dateutil.parser
 import babel
-from flask import Flask, render_template, request, Response, flash, redirect, url_for
+from flask import Flask, render_template, request, Response, flash, get_flashed_messages, redirect, url_for, stream_with_context, abort, g, has_request_context, make_response
 from flask_moment import Moment
-from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import FunctionElement
 import logging
 from logging import Formatter, FileHandler
 from flask_wtf import Form
 from forms import *
-from datetime import datetime
-import sys
+from search import NGramIndex
+from cache import Cache, MISSING, NEVER_EXPIRES, backend_from_config
+from dbpool import pool_stats, engine_options_from_config
+from routing import RoutingSQLAlchemy
+from metrics import Metrics
+from datetime import datetime, timedelta
+from itertools import groupby
+from collections import Counter
+from werkzeug.datastructures import MultiDict
+from werkzeug.exceptions import HTTPException
+from urllib.parse import urlencode
+from functools import wraps, lru_cache
 
 #----------------------------------------------------------------------------#
 # App Config.
@@ -23,8 +45,29 @@ import sys
 app = Flask(__name__)
 moment = Moment(app)
 app.config.from_object('config')
-db = SQLAlchemy(app)
+app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options_from_config(app.config))
+db = RoutingSQLAlchemy(app)
 migrate = Migrate(app, db)
+cache = Cache(backend_from_config(app.config))
+metrics = Metrics(prefix='fyyur_', directory=app.config['METRICS_DIR'])
+
+class TimedTemplate(app.jinja_env.template_class):
+  #render time per template, streamed templates are timed until their last chunk
+  def render(self, *args, **kwargs):
+    started = time.perf_counter()
+    try:
+      return super().render(*args, **kwargs)
+    finally:
+      metrics.observe('template_render_seconds', time.perf_counter() - started, template=self.name)
+
+  def generate(self, *args, **kwargs):
+    started = time.perf_counter()
+    try:
+      yield from super().generate(*args, **kwargs)
+    finally:
+      metrics.observe('template_render_seconds', time.perf_counter() - started, template=self.name)
+
+app.jinja_env.template_class = TimedTemplate
 # TODO: connect to a local postgresql database
 #DONE in config.py
 
@@ -32,8 +75,40 @@ migrate = Migrate(app, db)
 # Models.
 #----------------------------------------------------------------------------#
 
+class utcnow(FunctionElement):
+  #the database's clock in UTC, the single clock of the updated_at columns: now() alone
+  #is the session's local time for timestamp without time zone
+  type = db.DateTime()
+
+@compiles(utcnow, 'postgresql')
+def pg_utcnow(element, compiler, **kw):
+  return "timezone('utc', now())"
+
+@compiles(utcnow, 'sqlite')
+def sqlite_utcnow(element, compiler, **kw):
+  #UTC with microseconds, in the format sqlalchemy stores sqlite datetimes in
+  return "strftime('%Y-%m-%d %H:%M:%f000', 'now')"
+
+@compiles(utcnow)
+def default_utcnow(element, compiler, **kw):
+  return 'CURRENT_TIMESTAMP'
+
+class Genre(db.Model):
+    __tablename__ = 'genres'
+
+    #sqlite only autoincrements INTEGER primary keys
+    id = db.Column(db.SmallInteger().with_variant(db.Integer, 'sqlite'), primary_key=True)
+    name = db.Column(db.String(50), nullable=False, unique=True)
+
+    def __repr__(self):
+        return f'{self.name}'
+
 class Venue(db.Model):
     __tablename__ = 'venues'
+    __table_args__ = (
+        db.Index('ix_venues_name_trgm', 'name', postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}),
+        db.Index('ix_venues_state_city_id', 'state', 'city', 'id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String, nullable=False)
@@ -46,6 +121,12 @@ class Venue(db.Model):
     website = db.Column(db.String(200))
     seeking_talent = db.Column(db.Boolean, default=False)
     seeking_description = db.Column(db.String(200))
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    # kept by refreshShowCounters and the roll-show-counters job
+    upcoming_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    past_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    updated_at = db.Column(db.DateTime, nullable=False, index=True, default=utcnow(),
+                           onupdate=utcnow(), server_default=utcnow())
     genres = db.relationship('VenueGenre', backref='venue_genre', cascade='all,delete', lazy=True)
     shows = db.relationship('Show', backref='venue_show', cascade='all,delete', lazy=True)
 
@@ -58,15 +139,17 @@ class Venue(db.Model):
 class VenueGenre(db.Model):
     __tablename__ = 'venue_genres'
 
-    id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(), nullable=False)
-    venue_id = db.Column(db.Integer, db.ForeignKey('venues.id', ondelete='cascade'), nullable=False)
+    venue_id = db.Column(db.Integer, db.ForeignKey('venues.id', ondelete='cascade'), primary_key=True)
+    genre_id = db.Column(db.SmallInteger, db.ForeignKey('genres.id', ondelete='cascade'), primary_key=True, index=True)
 
     def __repr__(self):
-        return f'{self.name}'
+        return f'VenueGenre <venue_id: {self.venue_id}, genre_id: {self.genre_id}>'
 
 class Artist(db.Model):
     __tablename__ = 'artists'
+    __table_args__ = (
+        db.Index('ix_artists_name_trgm', 'name', postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String, nullable=False)
@@ -78,6 +161,12 @@ class Artist(db.Model):
     website = db.Column(db.String(200))
     seeking_venue = db.Column(db.Boolean, default=False)
     seeking_description = db.Column(db.String(200))
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    # kept by refreshShowCounters and the roll-show-counters job
+    upcoming_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    past_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    updated_at = db.Column(db.DateTime, nullable=False, index=True, default=utcnow(),
+                           onupdate=utcnow(), server_default=utcnow())
     genres = db.relationship('ArtistGenre', backref='artist_genre', cascade='all,delete', lazy=True)
     shows = db.relationship('Show', backref='artist_show', cascade='all,delete', lazy=True)
 
@@ -90,23 +179,29 @@ class Artist(db.Model):
 class ArtistGenre(db.Model):
     __tablename__ = 'artist_genres'
 
-    id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(), nullable=False)
-    artist_id = db.Column(db.Integer, db.ForeignKey('artists.id', ondelete='cascade'), nullable=False)
+    artist_id = db.Column(db.Integer, db.ForeignKey('artists.id', ondelete='cascade'), primary_key=True)
+    genre_id = db.Column(db.SmallInteger, db.ForeignKey('genres.id', ondelete='cascade'), primary_key=True, index=True)
 
     def __repr__(self):
-        return f'{self.name}'
+        return f'ArtistGenre <artist_id: {self.artist_id}, genre_id: {self.genre_id}>'
 
 # TODO Implement Show and Artist models, and complete all model relationships and properties, as a database migration.
 #DONE
 
 class Show(db.Model):
   __tablename__ = 'shows'
+  __table_args__ = (
+    db.Index('ix_shows_venue_id_start_time', 'venue_id', 'start_time'),
+    db.Index('ix_shows_artist_id_start_time', 'artist_id', 'start_time'),
+    db.Index('ix_shows_start_time_id', 'start_time', 'id'),
+  )
 
   id = db.Column(db.Integer, primary_key=True)
   venue_id = db.Column(db.Integer, db.ForeignKey('venues.id', ondelete='cascade'), nullable=False)
   artist_id = db.Column(db.Integer, db.ForeignKey('artists.id', ondelete='cascade'), nullable=False)
   start_time = db.Column(db.DateTime, nullable=False, default=datetime.today())
+  updated_at = db.Column(db.DateTime, nullable=False, index=True, default=utcnow(),
+    onupdate=utcnow(), server_default=utcnow())
 
   def __repr__(self):
     return f'Show <id: {self.id}, venue_id: {self.venue_id}, artist_id: {self.artist_id}, start_time: {self.start_time}>'
@@ -115,16 +210,561 @@ class Show(db.Model):
 # Filters.
 #----------------------------------------------------------------------------#
 
+DATETIME_FORMATS = {'full': "EEEE MMMM, d, y 'at' h:mma",
+  'medium': "EE MM, dd, y h:mma"}
+
+DATETIME_LOCALE = babel.Locale.parse('en')
+
+@lru_cache(maxsize=None)
+def datetimePattern(format):
+  #each babel pattern is compiled once
+  return babel.dates.parse_pattern(DATETIME_FORMATS.get(format, format))
+
+@lru_cache(maxsize=app.config['DATETIME_FORMAT_CACHE_SIZE'])
+def formatDatetime(date, format):
+  return datetimePattern(format).apply(date, DATETIME_LOCALE)
+
 def format_datetime(value, format='medium'):
-  date = dateutil.parser.parse(value)
-  if format == 'full':
-      format="EEEE MMMM, d, y 'at' h:mma"
-  elif format == 'medium':
-      format="EE MM, dd, y h:mma"
-  return babel.dates.format_datetime(date, format, locale='en')
+  #takes datetimes as they come from the database, strings are still parsed for older callers
+  if isinstance(value, str):
+    value = dateutil.parser.parse(value)
+  return formatDatetime(value, format)
 
 app.jinja_env.filters['datetime'] = format_datetime
 
+def stream_template(template_name, **context):
+  #renders the template chunk by chunk instead of building the whole document in memory.
+  #the session cookie goes out with the headers, before the layout renders, so the
+  #flashed messages are popped from it here and handed to the layout
+  context.setdefault('flashed_messages', get_flashed_messages())
+  app.update_template_context(context)
+  template = app.jinja_env.get_template(template_name)
+  return stream_with_context(template.generate(context))
+
+#----------------------------------------------------------------------------#
+# Sessions.
+#----------------------------------------------------------------------------#
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+REPLICA_BINDS = sorted(key for key in app.config['SQLALCHEMY_BINDS'] if key.startswith('replica_'))
+
+def selectReplica():
+  #a read-only request picks one replica for all its reads, unless its client
+  #wrote lately (read_primary cookie) and must see its own writes
+  if not has_request_context():
+    return None
+  if 'replica' not in g:
+    g.replica = None
+    if REPLICA_BINDS and request.method in SAFE_METHODS and not request.cookies.get('read_primary') and not g.get('use_primary'):
+      g.replica = db.get_engine(app, bind=random.choice(REPLICA_BINDS))
+  return g.replica
+
+db.replica_selector = selectReplica
+
+def cacheReplicaReads():
+  #what a replica returns shortly after a write may predate it, it is served but not cached
+  if not has_request_context() or g.get('replica') is None:
+    return True
+  last_write = cache.backend.get('last_write')
+  return last_write is MISSING or time.time() - last_write > app.config['REPLICA_STICKY_SECONDS']
+
+cache.accept_writes = cacheReplicaReads
+
+if REPLICA_BINDS and not cache.backend.shared:
+  app.logger.warning('read replicas need CACHE_BACKEND=redis under several workers: the last write is '
+    'only known to the worker that made it, the others cache what the replicas return right after it')
+
+@app.after_request
+def read_own_writes(response):
+  #requests that may have written send their client to the primary for a while,
+  #e.g. the page an edit redirects to
+  if REPLICA_BINDS and request.method not in SAFE_METHODS:
+    response.set_cookie('read_primary', '1', max_age=app.config['REPLICA_STICKY_SECONDS'], httponly=True)
+    cache.backend.set('last_write', time.time(), ttl=NEVER_EXPIRES)
+  return response
+
+@app.teardown_request
+def end_session(exception):
+  #one session per request: whatever the handler left uncommitted is rolled back and the
+  #connection goes back to the pool once the response, streamed ones included, is done
+  if exception is not None:
+    db.session.rollback()
+  db.session.remove()
+
+#----------------------------------------------------------------------------#
+# Query helpers.
+#----------------------------------------------------------------------------#
+
+class NPlusOneQuery(Exception):
+  #the same SELECT ran over and over in one request, typically a lazy load in a loop
+  pass
+
+@app.before_request
+def start_request_timer():
+  g.request_started = time.perf_counter()
+  g.db_time = 0.0
+  g.db_rows = 0
+  g.select_repeats = Counter()
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def count_statement(conn, cursor, statement, parameters, context, executemany):
+  #per-request counters of the SQL statements sent to the database
+  if not has_request_context():
+    return
+  g.statement_count = g.get('statement_count', 0) + 1
+  if 'request_started' not in g:
+    return
+  if statement.lstrip()[:6].upper() == 'SELECT':
+    g.select_repeats[statement] += 1
+    if g.select_repeats[statement] == app.config['N_PLUS_ONE_THRESHOLD'] + 1:
+      message = f'{request.endpoint} ran the same SELECT more than {app.config["N_PLUS_ONE_THRESHOLD"]} times: {statement}'
+      if app.testing:
+        raise NPlusOneQuery(message)
+      app.logger.warning(message)
+  conn.info.setdefault('statement_started', []).append(time.perf_counter())
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def time_statement(conn, cursor, statement, parameters, context, executemany):
+  started = conn.info.get('statement_started')
+  if not started or not has_request_context() or 'request_started' not in g:
+    return
+  g.db_time += time.perf_counter() - started.pop()
+  #drivers that buffer results (psycopg2) report the rows a SELECT returned, others -1
+  if cursor.rowcount > 0 and statement.lstrip()[:6].upper() == 'SELECT':
+    g.db_rows += cursor.rowcount
+
+@app.after_request
+def add_server_timing(response):
+  #streamed bodies are rendered after the headers are sent, their numbers stop at the first chunk
+  if 'request_started' in g:
+    g.response_status = response.status_code
+    response.headers.add('Server-Timing', f'db;dur={g.db_time * 1000:.1f};desc="{g.get("statement_count", 0)} statements, {g.db_rows} rows"')
+    response.headers.add('Server-Timing', f'app;dur={(time.perf_counter() - g.request_started) * 1000:.1f}')
+  return response
+
+@app.teardown_request
+def log_request(exception):
+  #one JSON line per request, written once streamed bodies have been sent
+  if 'request_started' not in g:
+    return
+  app.logger.info(json.dumps({'method': request.method,
+    'path': request.path,
+    'endpoint': request.endpoint,
+    'status': g.get('response_status', 500),
+    'duration_ms': round((time.perf_counter() - g.request_started) * 1000, 1),
+    'statements': g.get('statement_count', 0),
+    'db_ms': round(g.db_time * 1000, 1),
+    'rows': g.db_rows}))
+
+@app.teardown_request
+def record_request_metrics(exception):
+  if 'request_started' not in g:
+    return
+  endpoint = request.endpoint or 'none'
+  metrics.inc('http_requests_total', method=request.method, endpoint=endpoint, status=g.get('response_status', 500))
+  metrics.observe('http_request_duration_seconds', time.perf_counter() - g.request_started, endpoint=endpoint)
+  metrics.inc('db_statements_total', g.get('statement_count', 0), endpoint=endpoint)
+  metrics.inc('db_seconds_total', g.db_time, endpoint=endpoint)
+  metrics.flush()
+
+def query_budget(max_statements):
+  #fails the request when the view issued more statements than it is allowed to
+  def decorator(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+      response = f(*args, **kwargs)
+      statement_count = g.get('statement_count', 0)
+      message = f'{request.endpoint} issued {statement_count} SQL statements, the budget is {max_statements}'
+      if app.config.get('ASSERT_QUERY_BUDGET'):
+        assert statement_count <= max_statements, message
+      elif statement_count > max_statements:
+        app.logger.warning(message)
+      return response
+    return decorated_function
+  return decorator
+
+def conditional(validator):
+  #answers If-None-Match/If-Modified-Since with 304 before the view renders anything.
+  #validator takes the view arguments and returns (etag, last_modified) from a cheap
+  #query of updated_at columns, the view only runs when the client copy is stale.
+  def decorator(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+      etag, last_modified = validator(*args, **kwargs)
+      last_modified = last_modified and last_modified.replace(microsecond=0)
+      if request.if_none_match:
+        not_modified = request.if_none_match.contains(etag)
+      else:
+        not_modified = bool(request.if_modified_since and last_modified and last_modified <= request.if_modified_since)
+      response = Response(status=304) if not_modified else make_response(f(*args, **kwargs))
+      response.set_etag(etag)
+      if last_modified:
+        response.last_modified = last_modified
+      return response
+    return decorated_function
+  return decorator
+
+def makeEtag(*values):
+  return hashlib.sha1(repr(values).encode()).hexdigest()
+
+def detailValidator(model, owner_column, counterpart, counterpart_column):
+  #one aggregate over the entity, its shows and the entities it shares them with: it
+  #changes when any of them is written, a show is removed or a show moves to the past
+  def validator(**view_args):
+    entity_id = view_args[owner_column]
+    now = datetime.now()
+    row = db.session.query(model.updated_at,
+      db.func.max(Show.updated_at), db.func.max(counterpart.updated_at),
+      db.func.count(Show.id), db.func.count(db.case([(Show.start_time > now, Show.id)]))).\
+      outerjoin(Show, getattr(Show, owner_column)==model.id).\
+      outerjoin(counterpart, getattr(Show, counterpart_column)==counterpart.id).\
+      filter(model.id==entity_id).group_by(model.id, model.updated_at).first()
+    if row is None:
+      abort(404)
+    return makeEtag(entity_id, *row), max(value for value in row[:3] if value is not None)
+  return validator
+
+def listingValidator(*models):
+  #from the database alone, so that every worker agrees: the newest updated_at and the row
+  #count of the listed tables (a delete lowers the count), and the next show start for the
+  #counts that change with time
+  def validator(**view_args):
+    now = datetime.now()
+    row = db.session.query(*[db.select([db.func.max(model.updated_at)]).label(model.__tablename__) for model in models],
+      *[db.select([db.func.count()]).select_from(model.__table__).label(model.__tablename__ + '_count') for model in models],
+      db.select([db.func.min(Show.start_time)]).where(Show.start_time > now).label('next_show_time')).one()
+    updated_at = [value for value in row[:len(models)] if value is not None]
+    return makeEtag(*row), max(updated_at) if updated_at else None
+  return validator
+
+#genre dictionary, loaded once from the genres table
+genres_by_name = {}
+genres_by_id = {}
+
+def loadGenres():
+  rows = db.session.query(Genre.id, Genre.name).order_by(Genre.id).all()
+  genres_by_name.clear()
+  genres_by_name.update((name, genre_id) for genre_id, name in rows)
+  genres_by_id.clear()
+  genres_by_id.update(rows)
+  load_genre_choices([name for genre_id, name in rows])
+
+@app.before_first_request
+def load_genres():
+  loadGenres()
+  #startup work is not charged to the query budget of the first request
+  g.pop('statement_count', None)
+
+def findGenreId(name):
+  if not genres_by_name:
+    loadGenres()
+  return genres_by_name.get(name)
+
+def genreIds(names):
+  if not genres_by_name:
+    loadGenres()
+  return [genres_by_name[name] for name in names]
+
+def genreNames(genre_ids):
+  if not genres_by_id:
+    loadGenres()
+  return [genres_by_id[genre_id] for genre_id in genre_ids]
+
+def queryEntityDetail(model, entity_id):
+  #the venue/artist row together with its genres in a single joined query
+  return model.query.options(db.joinedload(model.genres)).filter(model.id==entity_id)
+
+def loadEntityDetail(model, entity_id):
+  entity=queryEntityDetail(model, entity_id).one_or_none()
+  if entity is None:
+    abort(404)
+  data={column.name: getattr(entity, column.name) for column in model.__table__.columns}
+  data['genres']=genreNames(genre.genre_id for genre in entity.genres)
+  return data
+
+def splitShows(shows, now, construct):
+  #one pass over the shows, a single start_time comparison decides past or upcoming
+  #the earliest upcoming show is the next moment the split changes
+  past_shows=[]
+  upcoming_shows=[]
+  next_transition=None
+  for show in shows:
+    if show.start_time > now:
+      upcoming_shows.append(construct(show))
+      if next_transition is None or show.start_time < next_transition:
+        next_transition=show.start_time
+    else:
+      past_shows.append(construct(show))
+  return {'past_shows': past_shows,
+  'upcoming_shows': upcoming_shows,
+  'past_shows_count': len(past_shows),
+  'upcoming_shows_count': len(upcoming_shows),
+  'next_transition': next_transition}
+
+def getTimeBucketed(key):
+  #entries holding a past/upcoming split are stale once their next transition has passed
+  value = cache.get(key)
+  if value is not MISSING and value['next_transition'] is not None and value['next_transition'] <= datetime.now():
+    return MISSING
+  return value
+
+def setTimeBucketed(key, value):
+  #kept until the next show starts, indefinitely when there is no upcoming show. A per-process
+  #backend only sees the invalidations of its own worker, there CACHE_DEFAULT_TTL caps how
+  #long the other workers serve an edited page
+  if value['next_transition'] is None:
+    ttl = NEVER_EXPIRES
+  else:
+    ttl = max((value['next_transition'] - datetime.now()).total_seconds(), 0)
+  if not cache.backend.shared:
+    ttl = min(ttl, app.config['CACHE_DEFAULT_TTL'])
+  cache.set(key, value, ttl)
+
+def getOrSetTimeBucketed(key, loader):
+  value = getTimeBucketed(key)
+  if value is MISSING:
+    value = loader()
+    setTimeBucketed(key, value)
+  return value
+
+def encodeCursor(values):
+  return base64.urlsafe_b64encode(json.dumps(values, default=datetime.isoformat).encode()).decode()
+
+def decodeCursor(cursor, order_columns):
+  try:
+    values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    #a cursor holds one value per order column
+    if not isinstance(values, list) or len(values) != len(order_columns):
+      abort(400)
+    return tuple(datetime.fromisoformat(value) if isinstance(column.type, db.DateTime) else value
+      for column, value in zip(order_columns, values))
+  except (ValueError, TypeError):
+    abort(400)
+
+class Page(object):
+  #keyset pagination: seeks past the ?after= cursor instead of counting an OFFSET,
+  #so every page costs the same however deep it is. Rows are yielded as they come
+  #off a server-side cursor, next_url is known once the page has been iterated.
+  #Pages read to the end are cached under the namespace of the listing, defaults the
+  #query took from outside the request args go in key_args.
+  def __init__(self, query, order_columns, namespace, key_args=()):
+    self.order_columns = order_columns
+    self.limit = min(max(request.args.get('limit', app.config['PAGE_SIZE'], type=int), 1), app.config['MAX_PAGE_SIZE'])
+    after = request.args.get('after')
+    if after:
+      query = query.filter(db.tuple_(*order_columns) > decodeCursor(after, order_columns))
+    self.query = query.order_by(*order_columns).limit(self.limit + 1)
+    self.cache_key = cache.namespace_key(namespace, urlencode(sorted(request.args.items(multi=True)) + list(key_args)))
+    self.next_cursor = None
+
+  def __iter__(self):
+    cached = cache.get(self.cache_key)
+    if cached is not MISSING:
+      self.next_cursor = cached['next_cursor']
+      yield from cached['rows']
+      return
+    rows = []
+    for index, row in enumerate(self.query.yield_per(app.config['YIELD_PER'])):
+      if index == self.limit:
+        #one row past the page tells there is a next page, it starts after the last row shown
+        self.next_cursor = encodeCursor([rows[-1][column.key] for column in self.order_columns])
+        break
+      rows.append(row._asdict())
+      yield rows[-1]
+    cache.set(self.cache_key, {'rows': rows, 'next_cursor': self.next_cursor})
+
+  @property
+  def next_url(self):
+    if self.next_cursor is None:
+      return None
+    args = request.args.to_dict()
+    args['after'] = self.next_cursor
+    return url_for(request.endpoint, **args)
+
+def insertGenres(genre_model, owner_column, owner_genres):
+  #one multi-row INSERT for the genres of every (owner id, genre names) pair
+  rows = [{'genre_id': genre_id, owner_column: owner_id} for owner_id, genres in owner_genres for genre_id in genreIds(genres)]
+  if rows:
+    db.session.execute(genre_model.__table__.insert().values(rows))
+
+def replaceGenres(genre_model, owner_column, owner_id, genres_tobe_added, genres_tobe_removed):
+  #the genre diff of one owner: one DELETE scoped to the owner and one multi-row INSERT
+  if genres_tobe_removed:
+    db.session.execute(genre_model.__table__.delete().where(db.and_(
+      getattr(genre_model, owner_column)==owner_id,
+      genre_model.genre_id.in_(genreIds(genres_tobe_removed)))))
+  insertGenres(genre_model, owner_column, [(owner_id, genres_tobe_added)])
+
+class EditConflict(Exception):
+  #the row was changed by someone else since the edit form was rendered
+  pass
+
+def formColumns(form, model):
+  #the form fields stored as plain columns of the model
+  return [field.name for field in form if field.name in model.__table__.c and field.name not in ('id', 'version')]
+
+def patchEntity(model, genre_model, owner_column, entity_id, form):
+  #applies an edit form as one UPDATE of the changed columns only, bumping the version.
+  #Returns the names of the changed columns (plus 'genres'), nothing is written when
+  #the list is empty; raises EditConflict when the row moved past the form's version.
+  columns = formColumns(form, model)
+  current = db.session.query(*[model.__table__.c[name] for name in columns + ['version']]).\
+    filter(model.id==entity_id).first()
+  if current is None:
+    abort(404)
+  #empty inputs and NULL columns, unchecked boxes and false flags are the same value
+  changes = {name: form[name].data for name in columns if (form[name].data or None) != (getattr(current, name) or None)}
+  current_genres = set(genreNames(genre_id for (genre_id,) in
+    db.session.query(genre_model.genre_id).filter(getattr(genre_model, owner_column)==entity_id)))
+  genres = set(form.genres.data or [])
+  if not changes and genres == current_genres:
+    return []
+
+  expected_version = int(form.version.data) if form.version.data else current.version
+  table = model.__table__
+  result = db.session.execute(table.update().
+    where(db.and_(table.c.id==entity_id, table.c.version==expected_version)).
+    values(version=table.c.version + 1, **changes))
+  if result.rowcount != 1:
+    raise EditConflict()
+  replaceGenres(genre_model, owner_column, entity_id, list(genres - current_genres), list(current_genres - genres))
+  #the UPDATE bypassed the ORM, the name index is kept in sync here
+  if 'name' in changes and search_indexes[model].built:
+    search_indexes[model].add(entity_id, changes['name'])
+  return list(changes) + (['genres'] if genres != current_genres else [])
+
+def refreshShowCounters(model, owner_column, entity_ids=None, now=None):
+  #recounts the upcoming and past shows of the given entities, of all of them when
+  #entity_ids is None, in one UPDATE with correlated counts served by the (owner, start_time) index
+  db.session.flush()
+  now = now or datetime.now()
+  owner = getattr(Show, owner_column)
+  def countShows(condition):
+    return db.select([db.func.count(Show.id)]).where(db.and_(owner==model.id, condition)).as_scalar()
+  statement = model.__table__.update().values(
+    upcoming_shows_count=countShows(Show.start_time > now),
+    past_shows_count=countShows(Show.start_time <= now))
+  if entity_ids is not None:
+    statement = statement.where(model.id.in_(entity_ids))
+  db.session.execute(statement)
+
+SHOW_COUNTERS = ((Venue, 'venue_id'), (Artist, 'artist_id'))
+
+def venueCacheKeys(venue_id):
+  #the venue page and the pages of the artists that played there show the venue
+  artist_ids = db.session.query(Show.artist_id).filter(Show.venue_id==venue_id).distinct()
+  return [f'venue:{venue_id}'] + [f'artist:{artist_id}' for (artist_id,) in artist_ids]
+
+def artistCacheKeys(artist_id):
+  #the artist page and the pages of the venues the artist played at show the artist
+  venue_ids = db.session.query(Show.venue_id).filter(Show.artist_id==artist_id).distinct()
+  return [f'artist:{artist_id}'] + [f'venue:{venue_id}' for (venue_id,) in venue_ids]
+
+#----------------------------------------------------------------------------#
+# Search.
+#----------------------------------------------------------------------------#
+
+#fallback name indexes for databases without pg_trgm
+search_indexes = {Venue: NGramIndex(), Artist: NGramIndex()}
+
+def containsPattern(search_term):
+  #LIKE pattern matching search_term anywhere, its wildcards taken literally
+  return '%' + re.sub(r'([\\%_])', r'\\\1', search_term) + '%'
+
+def searchEntities(model, search_term):
+  #returns the total number of matches and the best ranked page of them
+  limit = app.config['SEARCH_PAGE_SIZE']
+  if db.session.get_bind().dialect.name == 'postgresql':
+    #the GIN trigram index serves the ILIKE, count(*) OVER () counts the matches before the LIMIT
+    rows = db.session.query(model.id, model.name, db.func.count().over().label('total')).\
+      filter(model.name.ilike(containsPattern(search_term), escape='\\')).\
+      order_by(db.func.similarity(model.name, search_term).desc(), model.id).\
+      limit(limit).all()
+    return {'count': rows[0].total if rows else 0, 'data': rows}
+
+  search_index = search_indexes[model]
+  if not search_index.built:
+    search_index.build(db.session.query(model.id, model.name))
+  matched_ids = search_index.search(search_term)
+  page_ids = matched_ids[:limit]
+  rows = {row.id: row for row in db.session.query(model.id, model.name).filter(model.id.in_(page_ids))}
+  return {'count': len(matched_ids), 'data': [rows[row_id] for row_id in page_ids if row_id in rows]}
+
+@event.listens_for(Venue, 'after_insert')
+@event.listens_for(Venue, 'after_update')
+@event.listens_for(Artist, 'after_insert')
+@event.listens_for(Artist, 'after_update')
+def index_entity_name(mapper, connection, target):
+  search_index = search_indexes[mapper.class_]
+  if search_index.built:
+    search_index.add(target.id, target.name)
+
+@event.listens_for(Venue, 'after_delete')
+@event.listens_for(Artist, 'after_delete')
+def unindex_entity_name(mapper, connection, target):
+  search_indexes[mapper.class_].remove(target.id)
+
+#----------------------------------------------------------------------------#
+# Facets.
+#----------------------------------------------------------------------------#
+
+FACETS = ('genre', 'state', 'city')
+
+def filterEntities(query, model, genre_model, owner_column):
+  #applies the ?genre=, ?state= and ?city= filters of the listing
+  genre = request.args.get('genre')
+  if genre:
+    #an integer match on the association table, unknown genres match nothing
+    query = query.filter(db.exists().where(db.and_(
+      getattr(genre_model, owner_column)==model.id, genre_model.genre_id==findGenreId(genre))))
+  if request.args.get('state'):
+    query = query.filter(model.state==request.args['state'])
+  if request.args.get('city'):
+    query = query.filter(model.city==request.args['city'])
+  return query
+
+def queryFacetCounts(model, genre_model, owner_column):
+  #counts per state, city and genre of the filtered entities, all in one UNION ALL statement
+  filtered = filterEntities(db.session.query(model.id, model.state, model.city), model, genre_model, owner_column).subquery()
+  by_state = db.session.query(db.literal_column("'state'").label('facet'), filtered.c.state.label('value'), db.func.count().label('count')).\
+    group_by(filtered.c.state)
+  by_city = db.session.query(db.literal_column("'city'"), filtered.c.city, db.func.count()).\
+    group_by(filtered.c.city)
+  owner_id = getattr(genre_model, owner_column)
+  by_genre = db.session.query(db.literal_column("'genre'"), db.cast(genre_model.genre_id, db.String), db.func.count()).\
+    join(filtered, filtered.c.id==owner_id).\
+    group_by(genre_model.genre_id)
+  return by_state.union_all(by_city, by_genre)
+
+def getFacets(namespace, model, genre_model, owner_column):
+  #facet counts are cached with the listing pages, so writes refresh them too
+  filters = {name: request.args[name] for name in FACETS if request.args.get(name)}
+  key = cache.namespace_key(namespace, 'facets:' + urlencode(sorted(filters.items())))
+  counts = cache.get(key)
+  if counts is MISSING:
+    counts = {name: [] for name in FACETS}
+    for facet, value, count in queryFacetCounts(model, genre_model, owner_column):
+      if facet == 'genre':
+        value = genreNames([int(value)])[0]
+      counts[facet].append((value, count))
+    cache.set(key, counts)
+
+  facets = []
+  for name in FACETS:
+    options = []
+    for value, count in sorted(counts[name], key=lambda option: (-option[1], option[0])):
+      #a link toggles its filter and starts the listing over from the first page
+      args = dict(filters)
+      active = args.get(name) == value
+      if active:
+        del args[name]
+      else:
+        args[name] = value
+      options.append({'value': value, 'count': count, 'active': active, 'url': url_for(request.endpoint, **args)})
+    facets.append({'name': name, 'options': options})
+  return facets
+
 #----------------------------------------------------------------------------#
 # Controllers.
 #----------------------------------------------------------------------------#
@@ -148,7 +788,7 @@ def create_venue_submission():
   # TODO: modify data to be the data object returned from db insertion
   #DONE
   try:
-    print(request.form)
+    app.logger.debug(f'{request.endpoint} form: {request.form}')
     venue_name = request.form.get('name')
     venue_city = request.form.get('city')
     venue_state = request.form.get('state')
@@ -163,33 +803,22 @@ def create_venue_submission():
 
     newVenue = Venue(name=venue_name, city=venue_city, state=venue_state, address=venue_address, phone=venue_phone, image_link=venue_image, website=venue_website, facebook_link=venue_facebook, seeking_talent=venue_seeking_talent, seeking_description=venue_talent_description)
     db.session.add(newVenue)
-    insert_venue_genres(venue_genres)
+    #the flush INSERTs the venue and gets its id back (RETURNING on postgres)
+    db.session.flush()
+    insertGenres(VenueGenre, 'venue_id', [(newVenue.id, venue_genres)])
     db.session.commit()
+    cache.invalidate_namespace('venues')
     # on successful db insert, flash success
     flash('Venue ' + venue_name + ' was successfully listed!')
   except:
-    print(sys.exc_info())
+    app.logger.exception(f'{request.endpoint} failed')
     db.session.rollback()
     # TODO: on unsuccessful db insert, flash an error instead.
     #DONE
     flash('An error occurred. Venue ' + venue_name + ' could not be listed.')
     # see: http://flask.pocoo.org/docs/1.0/patterns/flashing/
-  finally:
-    db.session.close()
   return render_template('pages/home.html')
 
-def insert_venue_genres(genres):
-  try:
-    #insert venue genres in venue_genres table
-    latest_venue = Venue.query.order_by(Venue.id.desc()).first()
-    for genre in genres:
-      newGenre = VenueGenre(name=genre, venue_id=latest_venue.id)
-      db.session.add(newGenre)
-  except:
-    print(sys.exc_info())
-    db.session.rollback()
-    raise Exception('error occured while handling venue genres')
-
 @app.route('/venues/<venue_id>/delete', methods=['delete'])
 def delete_venue(venue_id):
   # TODO: Complete this endpoint for taking a venue_id, and using
@@ -199,19 +828,24 @@ def delete_venue(venue_id):
   try:
     venue_tobe_deleted = Venue.query.get(venue_id)
     venue_name = venue_tobe_deleted.name
-    print(venue_tobe_deleted)
+    app.logger.debug(f'deleting {venue_tobe_deleted}')
+    cache_keys = venueCacheKeys(venue_id)
+    artist_ids = [artist_id for (artist_id,) in db.session.query(Show.artist_id).filter(Show.venue_id==venue_id).distinct()]
     db.session.delete(venue_tobe_deleted)
+    #the shows went with the venue, the artists that played there lose them from their counters
+    refreshShowCounters(Artist, 'artist_id', artist_ids)
     db.session.commit()
+    cache.invalidate(*cache_keys)
+    cache.invalidate_namespace('venues', 'shows')
     flash('Venue \"' + venue_name + '\" was successfully deleted!')
   except:
-    print(sys.exc_info())
+    app.logger.exception(f'{request.endpoint} failed')
     db.session.rollback()
     flash('An error occured while deleting venue: ' + venue_name)
-  finally:
-    db.session.close()
   return redirect(url_for('venues'))
 
 @app.route('/venues')
+@conditional(listingValidator(Venue, Show))
 def venues():
   # TODO: replace with real venues data.
   #DONE
@@ -237,32 +871,25 @@ def venues():
       "num_upcoming_shows": 0,
     }]
   }]'''
-  all_venues = Venue.query.all()
-  data=[]
-  city_state_list = getAllCityState(all_venues)
-  print(city_state_list)
-  for city_state in city_state_list:
-    city_state_venues = getAllCityStateVenues(city_state, all_venues)
-    item = {'city': city_state['city'],
-    'state': city_state['state'],
-    'venues': city_state_venues}
-    data.append(item)
-  return render_template('pages/venues.html', areas=data)
-
-def getAllCityState(all_venues):
-  city_state_list = []
-  for venue in all_venues:
-    city_state={'city': venue.city, 'state': venue.state}
-    if city_state not in city_state_list:
-      city_state_list.append(city_state)
-  return city_state_list
-
-def getAllCityStateVenues(city_state, all_venues):
-  city_state_venues = []
-  for venue in all_venues:
-    if venue.city == city_state['city'] and venue.state == city_state['state']:
-      city_state_venues.append(venue)
-  return city_state_venues
+  page = Page(filterEntities(queryVenueListing(), Venue, VenueGenre, 'venue_id'),
+    VENUE_LISTING_ORDER, 'venues')
+  facets = getFacets('venues', Venue, VenueGenre, 'venue_id')
+  return Response(stream_template('pages/venues.html', areas=getVenueAreas(page), page=page, facets=facets))
+
+#venues of the same city/state come out next to each other
+VENUE_LISTING_ORDER = (Venue.state, Venue.city, Venue.id)
+
+def queryVenueListing():
+  #venue columns only, the number of upcoming shows is the venue's own counter
+  return db.session.query(Venue.city, Venue.state, Venue.id, Venue.name,
+    Venue.upcoming_shows_count.label('num_upcoming_shows'))
+
+def getVenueAreas(rows):
+  #single pass over the ordered rows, yields one area per city/state
+  for (city, state), venues in groupby(rows, key=lambda row: (row['city'], row['state'])):
+    yield {'city': city,
+    'state': state,
+    'venues': list(venues)}
 
 @app.route('/venues/search', methods=['POST'])
 def search_venues():
@@ -279,14 +906,12 @@ def search_venues():
     }]
   }'''
   search_keyword=request.form.get('search_term', '')
-  search_query=Venue.query.filter(Venue.name.ilike('%'+search_keyword+'%'))
-  search_count=search_query.count()
-  search_result=search_query.all()
-  response={'count': search_count,
-    'data': search_result}
+  response=searchEntities(Venue, search_keyword)
   return render_template('pages/search_venues.html', results=response, search_term=search_keyword)
 
 @app.route('/venues/<int:venue_id>')
+@query_budget(3)
+@conditional(detailValidator(Venue, 'venue_id', Artist, 'artist_id'))
 def show_venue(venue_id):
   # shows the venue page with the given venue_id
   # TODO: replace with real venue data from the venues table, using venue_id
@@ -368,38 +993,23 @@ def show_venue(venue_id):
     "past_shows_count": 1,
     "upcoming_shows_count": 1,
   }'''
-  selected_venue=Venue.query.get(venue_id)
-  genres=VenueGenre.query.filter_by(venue_id=venue_id).all()
-  selected_venue.genres=genres
-
-  #get current datetime stamp
-  datetime_now=datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-  upcoming_shows_for_venue=Show.query.filter(Show.venue_id==venue_id, Show.start_time>str(datetime_now))
-  upcoming_shows_count=upcoming_shows_for_venue.count()
-  selected_venue.upcoming_shows_count=upcoming_shows_count
+  venue=getOrSetTimeBucketed(f'venue:{venue_id}', lambda: loadVenue(venue_id))
+  return render_template('pages/show_venue.html', venue=venue)
 
-  upcoming_shows=db.session.query(Artist, Show).join(Show).filter(Show.venue_id==venue_id, Show.start_time>str(datetime_now)).all()
-  selected_venue.upcoming_shows=constructVenueShows(upcoming_shows)
+def loadVenue(venue_id):
+  venue=loadEntityDetail(Venue, venue_id)
+  venue.update(splitShows(queryVenueShows(venue_id), datetime.now(), constructVenueShow))
+  return venue
 
-  past_shows_for_venue=Show.query.filter(Show.venue_id==venue_id, Show.start_time<str(datetime_now))
-  past_shows_count=past_shows_for_venue.count()
-  selected_venue.past_shows_count=past_shows_count
+def queryVenueShows(venue_id):
+  return db.session.query(Show.start_time, Artist.id, Artist.name, Artist.image_link).\
+    join(Artist).filter(Show.venue_id==venue_id).order_by(Show.start_time)
 
-  past_shows=db.session.query(Artist, Show).join(Show).filter(Show.venue_id==venue_id, Show.start_time<str(datetime_now)).all()
-  selected_venue.past_shows=constructVenueShows(past_shows)
-
-  return render_template('pages/show_venue.html', venue=selected_venue)
-
-def constructVenueShows(shows):
-  _list = []
-  for show in shows:
-    item = {'artist_image_link': show[0].image_link,
-    'artist_id': show[0].id,
-    'artist_name': show[0].name,
-    'start_time': str(show[1].start_time)}
-    _list.append(item)
-  return _list
+def constructVenueShow(show):
+  return {'artist_image_link': show.image_link,
+  'artist_id': show.id,
+  'artist_name': show.name,
+  'start_time': show.start_time}
 
 #  Artists
 #  ----------------------------------------------------------------
@@ -416,7 +1026,7 @@ def create_artist_submission():
   # TODO: modify data to be the data object returned from db insertion
   #DONE
   try:
-    print(request.form)
+    app.logger.debug(f'{request.endpoint} form: {request.form}')
     artist_name= request.form.get('name')
     artist_city= request.form.get('city')
     artist_state= request.form.get('state')
@@ -431,33 +1041,23 @@ def create_artist_submission():
     newArtist = Artist(name=artist_name, city=artist_city, state=artist_state, phone=artist_phone, image_link=artist_image, website=artist_website, facebook_link=artist_facebook, seeking_venue=artist_seeking_venue, seeking_description=artist_venue_description)
 
     db.session.add(newArtist)
-    insert_artist_genres(artist_genres)
+    #the flush INSERTs the artist and gets its id back (RETURNING on postgres)
+    db.session.flush()
+    insertGenres(ArtistGenre, 'artist_id', [(newArtist.id, artist_genres)])
     db.session.commit()
+    cache.invalidate_namespace('artists')
     # on successful db insert, flash success
     flash('Artist ' + artist_name + ' was successfully listed!')
   except:
-    print(sys.exc_info())
+    app.logger.exception(f'{request.endpoint} failed')
     db.session.rollback()
     # TODO: on unsuccessful db insert, flash an error instead.
     #DONE
     flash('An error occurred. Artist ' + artist_name + ' could not be listed.')
-  finally:
-    db.session.close()
   return render_template('pages/home.html')
 
-def insert_artist_genres(genres):
-  try:
-    #insert artist genres in artist_genres table
-    latest_artist = Artist.query.order_by(Artist.id.desc()).first()
-    for genre in genres:
-      newGenre = ArtistGenre(name=genre, artist_id=latest_artist.id)
-      db.session.add(newGenre)
-  except:
-    print(sys.exc_info())
-    db.session.rollback()
-    raise Exception('error occured while handling artist genres')
-
 @app.route('/artists')
+@conditional(listingValidator(Artist))
 def artists():
   # TODO: replace with real data returned from querying the database
   #DONE
@@ -471,8 +1071,10 @@ def artists():
     "id": 6,
     "name": "The Wild Sax Band",
   }]'''
-  data=Artist.query.order_by('id').all()
-  return render_template('pages/artists.html', artists=data)
+  page=Page(filterEntities(db.session.query(Artist.id, Artist.name), Artist, ArtistGenre, 'artist_id'),
+    (Artist.id,), 'artists')
+  facets=getFacets('artists', Artist, ArtistGenre, 'artist_id')
+  return Response(stream_template('pages/artists.html', artists=page, page=page, facets=facets))
 
 @app.route('/artists/search', methods=['POST'])
 def search_artists():
@@ -489,16 +1091,12 @@ def search_artists():
     }]
   }'''
   search_keyword=request.form.get('search_term', '')
-  print(search_keyword)
-  search_count=Artist.query.filter(Artist.name.ilike('%'+search_keyword+'%')).count()
-  print(search_count)
-  search_result=Artist.query.filter(Artist.name.ilike('%'+search_keyword+'%')).all()
-  print(search_result)
-  response={'count': search_count,
-    'data': search_result}
+  response=searchEntities(Artist, search_keyword)
   return render_template('pages/search_artists.html', results=response, search_term=search_keyword)
 
 @app.route('/artists/<int:artist_id>')
+@query_budget(3)
+@conditional(detailValidator(Artist, 'artist_id', Venue, 'venue_id'))
 def show_artist(artist_id):
   # shows the artist page with the given artist_id
   # TODO: replace with real artist data from the artists table, using artist_id
@@ -574,38 +1172,23 @@ def show_artist(artist_id):
     "past_shows_count": 0,
     "upcoming_shows_count": 3,
   }'''
-  select_artist=Artist.query.get(artist_id)
-  genres=ArtistGenre.query.filter_by(artist_id=artist_id).all()
-  select_artist.genres=genres
-
-  #get current datetime stamp
-  datetime_now=datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-  upcoming_shows_for_artist=Show.query.filter(Show.artist_id==artist_id, Show.start_time>str(datetime_now))
-  upcoming_shows_count=upcoming_shows_for_artist.count()
-  select_artist.upcoming_shows_count=upcoming_shows_count
+  artist=getOrSetTimeBucketed(f'artist:{artist_id}', lambda: loadArtist(artist_id))
+  return render_template('pages/show_artist.html', artist=artist)
 
-  upcoming_shows=db.session.query(Venue, Show).join(Show).filter(Show.artist_id==artist_id, Show.start_time>str(datetime_now)).all()
-  select_artist.upcoming_shows=constructArtistShows(upcoming_shows)
+def loadArtist(artist_id):
+  artist=loadEntityDetail(Artist, artist_id)
+  artist.update(splitShows(queryArtistShows(artist_id), datetime.now(), constructArtistShow))
+  return artist
 
-  past_shows_for_artist=Show.query.filter(Show.artist_id==artist_id, Show.start_time<str(datetime_now))
-  past_shows_count=past_shows_for_artist.count()
-  select_artist.past_shows_count=past_shows_count
-
-  past_shows=db.session.query(Venue, Show).join(Show).filter(Show.artist_id==artist_id, Show.start_time<str(datetime_now)).all()
-  select_artist.past_shows=constructArtistShows(past_shows)
-  
-  return render_template('pages/show_artist.html', artist=select_artist)
+def queryArtistShows(artist_id):
+  return db.session.query(Show.start_time, Venue.id, Venue.name, Venue.image_link).\
+    join(Venue).filter(Show.artist_id==artist_id).order_by(Show.start_time)
 
-def constructArtistShows(shows):
-  _list = []
-  for show in shows:
-    item = {'venue_image_link': show[0].image_link,
-    'venue_id': show[0].id,
-    'venue_name': show[0].name,
-    'start_time': str(show[1].start_time)}
-    _list.append(item)
-  return _list
+def constructArtistShow(show):
+  return {'venue_image_link': show.image_link,
+  'venue_id': show.id,
+  'venue_name': show.name,
+  'start_time': show.start_time}
 
 #  Update
 #  ----------------------------------------------------------------
@@ -615,9 +1198,10 @@ def edit_artist(artist_id):
   #DONE
   artist=Artist.query.get(artist_id)
   form = ArtistForm(state=artist.state, 
-  genres=artist.genres, 
+  genres=genreNames(genre.genre_id for genre in artist.genres), 
   seeking_venue=artist.seeking_venue,
-  seeking_description=artist.seeking_description)
+  seeking_description=artist.seeking_description,
+  version=artist.version)
   
   return render_template('forms/edit_artist.html', form=form, artist=artist)
 
@@ -627,76 +1211,36 @@ def edit_artist_submission(artist_id):
   # artist record with ID <artist_id> using the new attributes
   #DONE
 
-  artist=Artist.query.get(artist_id)
-  #update name
-  name = request.form.get('name')
-  if artist.name != name:
-    artist.name = name
-  #update city
-  city = request.form.get('city')
-  if artist.city != city:
-    artist.city = city
-  #update state
-  state = request.form.get('state')
-  if artist.state != state:
-    artist.state = state
-  #update phone
-  phone = request.form.get('phone')
-  if artist.phone != phone:
-    artist.phone = phone
-  #update image link
-  image_link = request.form.get('image_link')
-  if artist.image_link != image_link:
-    artist.image_link = image_link
-  #update website
-  website = request.form.get('website')
-  if artist.website != website:
-    artist.website = website
-  #update facebook link
-  facebook_link = request.form.get('facebook_link')
-  if artist.facebook_link != facebook_link:
-    artist.facebook_link = facebook_link
-  #update seeking venue
-  seeking_venue = bool(request.form.get('seeking_venue'))
-  artist.seeking_venue = seeking_venue
-  #update seeking description
-  seeking_description = request.form.get('seeking_description')
-  if artist.seeking_description != seeking_description:
-    artist.seeking_description = seeking_description
-  #update genres
-  artist_current_genres=list(map(str, artist.genres))
-  genres = request.form.getlist('genres')
-  genres_tobe_added=list(set(genres) - set(artist_current_genres))
-  genres_tobe_removed=list(set(artist_current_genres) - set(genres))
-  update_artist_genres(artist_id, genres_tobe_added, genres_tobe_removed)
-
+  form = ArtistForm()
   try:
-    db.session.commit()
+    #only the changed columns are written, nothing at all when the form is unchanged
+    if patchEntity(Artist, ArtistGenre, 'artist_id', artist_id, form):
+      cache_keys = artistCacheKeys(artist_id)
+      db.session.commit()
+      cache.invalidate(*cache_keys)
+      cache.invalidate_namespace('artists', 'shows')
+  except HTTPException:
+    raise
+  except EditConflict:
+    db.session.rollback()
+    flash(f'Artist {form.name.data or artist_id} was changed by someone else in the meantime, please review it and edit again.')
+    return redirect(url_for('edit_artist', artist_id=artist_id))
   except:
+    app.logger.exception(f'{request.endpoint} failed')
     db.session.rollback()
-  finally:
-    db.session.close()
+    flash(f'An error occurred. Artist {form.name.data or artist_id} could not be updated.')
+    return redirect(url_for('edit_artist', artist_id=artist_id))
 
   return redirect(url_for('show_artist', artist_id=artist_id))
 
-def update_artist_genres(artist_id, genres_tobe_added, genres_tobe_removed):
-  try:
-    for genre in genres_tobe_added:
-      newGenre = ArtistGenre(name=genre, artist_id=artist_id)
-      db.session.add(newGenre)
-    for genre in genres_tobe_removed:
-      ArtistGenre.query.filter_by(name=genre).delete()
-  except:
-    db.session.rollback()
-    raise Exception('error occured while handling artist genres')
-
 @app.route('/venues/<int:venue_id>/edit', methods=['GET'])
 def edit_venue(venue_id):
   venue=Venue.query.get(venue_id)
   form = VenueForm(state=venue.state, 
-  genres=venue.genres, 
+  genres=genreNames(genre.genre_id for genre in venue.genres), 
   seeking_talent=venue.seeking_talent,
-  seeking_description=venue.seeking_description)
+  seeking_description=venue.seeking_description,
+  version=venue.version)
 
   return render_template('forms/edit_venue.html', form=form, venue=venue)
 
@@ -706,77 +1250,33 @@ def edit_venue_submission(venue_id):
   # venue record with ID <venue_id> using the new attributes
   #DONE
 
-  venue=Venue.query.get(venue_id)
-  #update name
-  name = request.form.get('name')
-  if venue.name != name:
-    venue.name = name
-  #update city
-  city = request.form.get('city')
-  if venue.city != city:
-    venue.city = city
-  #update state
-  state = request.form.get('state')
-  if venue.state != state:
-    venue.state = state
-  #update address
-  address = request.form.get('address')
-  if venue.address != address:
-    venue.address = address
-  #update phone
-  phone = request.form.get('phone')
-  if venue.phone != phone:
-    venue.phone = phone
-  #update image link
-  image_link = request.form.get('image_link')
-  if venue.image_link != image_link:
-    venue.image_link = image_link
-  #update website
-  website = request.form.get('website')
-  if venue.website != website:
-    venue.website = website
-  #update facebook link
-  facebook_link = request.form.get('facebook_link')
-  if venue.facebook_link != facebook_link:
-    venue.facebook_link = facebook_link
-  #update seeking talent
-  seeking_talent = bool(request.form.get('seeking_talent'))
-  venue.seeking_talent = seeking_talent
-  #update seeking description
-  seeking_description = request.form.get('seeking_description')
-  if venue.seeking_description != seeking_description:
-    venue.seeking_description = seeking_description
-  #update genres
-  venue_current_genres=list(map(str, venue.genres))
-  genres = request.form.getlist('genres')
-  genres_tobe_added=list(set(genres) - set(venue_current_genres))
-  genres_tobe_removed=list(set(venue_current_genres) - set(genres))
-  update_venue_genres(venue_id, genres_tobe_added, genres_tobe_removed)
-
+  form = VenueForm()
   try:
-    db.session.commit()
+    #only the changed columns are written, nothing at all when the form is unchanged
+    if patchEntity(Venue, VenueGenre, 'venue_id', venue_id, form):
+      cache_keys = venueCacheKeys(venue_id)
+      db.session.commit()
+      cache.invalidate(*cache_keys)
+      cache.invalidate_namespace('venues', 'shows')
+  except HTTPException:
+    raise
+  except EditConflict:
+    db.session.rollback()
+    flash(f'Venue {form.name.data or venue_id} was changed by someone else in the meantime, please review it and edit again.')
+    return redirect(url_for('edit_venue', venue_id=venue_id))
   except:
+    app.logger.exception(f'{request.endpoint} failed')
     db.session.rollback()
-  finally:
-    db.session.close()
+    flash(f'An error occurred. Venue {form.name.data or venue_id} could not be updated.')
+    return redirect(url_for('edit_venue', venue_id=venue_id))
 
   return redirect(url_for('show_venue', venue_id=venue_id))
 
-def update_venue_genres(venue_id, genres_tobe_added, genres_tobe_removed):
-  try:
-    for genre in genres_tobe_added:
-      newGenre = VenueGenre(name=genre, venue_id=venue_id)
-      db.session.add(newGenre)
-    for genre in genres_tobe_removed:
-      VenueGenre.query.filter_by(name=genre).delete()
-  except:
-    db.session.rollback()
-    raise Exception('error occured while handling venue genres')
-
 #  Shows
 #  ----------------------------------------------------------------
 
 @app.route('/shows')
+@conditional(listingValidator(Show, Venue, Artist))
 def shows():
   # displays list of shows at /shows
   # TODO: replace with real shows data.
@@ -817,17 +1317,60 @@ def shows():
     "artist_image_link": "https://images.unsplash.com/photo-1558369981-f9ca78462e61?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=794&q=80",
     "start_time": "2035-04-15T20:00:00.000Z"
   }]'''
-  shows=db.session.query(Show, Venue, Artist).join(Venue, Artist).all()
-  data=[]
-  for show in shows:
-    item = { 'venue_id': show[0].venue_id,
-    'venue_name': show[1].name,
-    'artist_id': show[0].artist_id,
-    'artist_name': show[2].name,
-    'artist_image_link': show[2].image_link,
-    'start_time': str(show[0].start_time) }
-    data.append(item)
-  return render_template('pages/shows.html', shows=data)
+  page=Page(queryShowListing(), (Show.start_time, Show.id), 'shows')
+  data=(constructShow(show) for show in page)
+  return Response(stream_template('pages/shows.html', shows=data, page=page))
+
+def queryShowListing():
+  return db.session.query(Show.id, Show.start_time, Show.venue_id, Venue.name.label('venue_name'),
+    Show.artist_id, Artist.name.label('artist_name'), Artist.image_link.label('artist_image_link')).\
+    join(Venue, Show.venue_id==Venue.id).join(Artist, Show.artist_id==Artist.id)
+
+def constructShow(show):
+  return { 'venue_id': show['venue_id'],
+  'venue_name': show['venue_name'],
+  'artist_id': show['artist_id'],
+  'artist_name': show['artist_name'],
+  'artist_image_link': show['artist_image_link'],
+  'start_time': show['start_time'] }
+
+@app.route('/shows/search')
+def search_shows():
+  page, date_from, date_to = searchShowsPage()
+  data=(constructShow(show) for show in page)
+  return Response(stream_template('pages/search_shows.html', shows=data, page=page,
+    search=request.args, date_from=date_from.date(), date_to=date_to and date_to.date()))
+
+def searchShowsPage():
+  #?artist=, ?venue=, ?city= and a ?from=/?to= date window, in date order.
+  #The window is a range on ix_shows_start_time_id and defaults to the shows from
+  #today on, so no search reads the whole shows table; name matches go through the
+  #trigram indexes and the city through ix_venues_state_city_id.
+  date_from = searchDate('from') or datetime.combine(datetime.now().date(), datetime.min.time())
+  date_to = searchDate('to')
+  query = queryShowListing().filter(Show.start_time >= date_from)
+  if date_to:
+    #the whole last day of the window is included
+    query = query.filter(Show.start_time < date_to + timedelta(days=1))
+  if request.args.get('artist'):
+    query = query.filter(Artist.name.ilike(containsPattern(request.args['artist']), escape='\\'))
+  if request.args.get('venue'):
+    query = query.filter(Venue.name.ilike(containsPattern(request.args['venue']), escape='\\'))
+  if request.args.get('state'):
+    query = query.filter(Venue.state==request.args['state'])
+  if request.args.get('city'):
+    query = query.filter(Venue.city==request.args['city'])
+  page=Page(query, (Show.start_time, Show.id), 'shows', key_args=[('default_from', date_from.date().isoformat())])
+  return page, date_from, date_to
+
+def searchDate(arg):
+  value = request.args.get(arg)
+  if not value:
+    return None
+  try:
+    return datetime.strptime(value, '%Y-%m-%d')
+  except ValueError:
+    abort(400)
 
 @app.route('/shows/create')
 def create_shows():
@@ -843,32 +1386,190 @@ def create_show_submission():
   try:
     artist_id = request.form.get('artist_id')
     venue_id = request.form.get('venue_id')
-    start_time = request.form.get('start_time')
+    start_time = dateutil.parser.parse(request.form.get('start_time'))
 
     newShow = Show(artist_id=artist_id, venue_id=venue_id, start_time=start_time)
 
     db.session.add(newShow)
+    refreshShowCounters(Venue, 'venue_id', [venue_id])
+    refreshShowCounters(Artist, 'artist_id', [artist_id])
     db.session.commit()
+    #the upcoming show counts of the venue listing change too
+    cache.invalidate(f'venue:{venue_id}', f'artist:{artist_id}')
+    cache.invalidate_namespace('shows', 'venues')
     # on successful db insert, flash success
     flash('Show is successfully listed!')
   except:
-    print(sys.exc_info())
+    app.logger.exception(f'{request.endpoint} failed')
     db.session.rollback()
     # TODO: on unsuccessful db insert, flash an error instead.
     flash('Show could not be listed, either \"Artist ID\" or \"Venue ID\" or \"Start Time\" is not correct!')
-  finally:
-    db.session.close()
   return redirect(url_for('shows'))
 
+#  API
+#  ----------------------------------------------------------------
+
+#the JSON API serves the same queries and caches as the HTML pages, without templates
+
+def jsonResponse(payload):
+  #compact JSON with a strong ETag of the body, answers If-None-Match with 304
+  body = json.dumps(payload, separators=(',', ':'), default=datetime.isoformat)
+  response = Response(body, mimetype='application/json')
+  response.add_etag()
+  return response.make_conditional(request)
+
+def apiError(status, message):
+  return Response(json.dumps({'error': message}, separators=(',', ':')), status=status, mimetype='application/json')
+
+def selectFields(item):
+  #?fields=id,name keeps only the listed keys of every item
+  fields = request.args.get('fields')
+  if not fields:
+    return item
+  fields = fields.split(',')
+  unknown = [field for field in fields if field not in item]
+  if unknown:
+    abort(400)
+  return {field: item[field] for field in fields}
+
+def apiPage(page, construct=dict):
+  data = [selectFields(construct(row)) for row in page]
+  return jsonResponse({'data': data, 'next': page.next_url})
+
+def apiDetail(key, loader):
+  entity = dict(getOrSetTimeBucketed(key, loader))
+  entity.pop('next_transition')
+  return jsonResponse(selectFields(entity))
+
+@app.route('/api/v1/venues')
+def api_venues():
+  return apiPage(Page(filterEntities(queryVenueListing(), Venue, VenueGenre, 'venue_id'),
+    VENUE_LISTING_ORDER, 'venues'))
+
+@app.route('/api/v1/venues/<int:venue_id>')
+def api_venue(venue_id):
+  return apiDetail(f'venue:{venue_id}', lambda: loadVenue(venue_id))
+
+@app.route('/api/v1/artists')
+def api_artists():
+  return apiPage(Page(filterEntities(db.session.query(Artist.id, Artist.name), Artist, ArtistGenre, 'artist_id'),
+    (Artist.id,), 'artists'))
+
+@app.route('/api/v1/artists/<int:artist_id>')
+def api_artist(artist_id):
+  return apiDetail(f'artist:{artist_id}', lambda: loadArtist(artist_id))
+
+@app.route('/api/v1/shows')
+def api_shows():
+  return apiPage(Page(queryShowListing(), (Show.start_time, Show.id), 'shows'))
+
+@app.route('/api/v1/shows/search')
+def api_search_shows():
+  page, date_from, date_to = searchShowsPage()
+  return apiPage(page)
+
+@app.route('/api/v1/search/<any(venues, artists):entity>')
+def api_search(entity):
+  results = searchEntities(Venue if entity == 'venues' else Artist, request.args.get('q', ''))
+  return jsonResponse({'count': results['count'],
+    'data': [selectFields(row._asdict()) for row in results['data']]})
+
+@app.route('/metrics')
+def prometheus_metrics():
+  return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@metrics.collector
+def collect_pool_stats():
+  stats = pool_stats.snapshot()
+  yield 'gauge', 'db_pool_size', {}, stats['size']
+  yield 'gauge', 'db_pool_checked_out', {}, stats['checked_out']
+  yield 'counter', 'db_pool_checkouts_total', {}, stats['checkouts']
+  yield 'counter', 'db_pool_timeouts_total', {}, stats['timeouts']
+  yield 'counter', 'db_pool_wait_seconds_total', {}, stats['wait_seconds']
+
+@metrics.collector
+def collect_cache_stats():
+  for kind, counts in cache.stats().items():
+    yield 'counter', 'cache_hits_total', {'kind': kind}, counts['hits']
+    yield 'counter', 'cache_misses_total', {'kind': kind}, counts['misses']
+
+metrics.ratio('cache_hit_ratio', 'cache_hits_total', 'cache_misses_total')
+
+@app.route('/_stats')
+def stats():
+  #connection pool and page cache counters of this process
+  return jsonResponse({'pool': pool_stats.snapshot(), 'cache': cache.stats()})
+
+#  Export
+#  ----------------------------------------------------------------
+
+#tables that can be exported, in dependency order
+EXPORTABLE_TABLES = {model.__tablename__: model.__table__ for model in (Genre, Venue, Artist, VenueGenre, ArtistGenre, Show)}
+
+EXPORT_MIMETYPES = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+def exportChunks(table, file_format, stats=None):
+  #reads the table through a server-side cursor and yields it as text, one chunk per fetch
+  connection = db.session.connection().execution_options(stream_results=True)
+  result = connection.execute(table.select().order_by(*table.primary_key.columns))
+  columns = result.keys()
+  if file_format == 'csv':
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(columns)
+    yield buffer.getvalue()
+  while True:
+    rows = result.fetchmany(app.config['YIELD_PER'])
+    if not rows:
+      break
+    buffer = io.StringIO()
+    if file_format == 'csv':
+      csv.writer(buffer).writerows(rows)
+    else:
+      for row in rows:
+        buffer.write(json.dumps(dict(zip(columns, row)), default=str) + '\n')
+    if stats is not None:
+      stats['rows'] = stats.get('rows', 0) + len(rows)
+    yield buffer.getvalue()
+
+def gzipChunks(chunks):
+  #compresses on the fly, nothing but the current chunk is held in memory
+  compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+  for chunk in chunks:
+    data = compressor.compress(chunk.encode())
+    if data:
+      yield data
+  yield compressor.flush()
+
+@app.route('/export/<entity>.<file_format>')
+def export(entity, file_format):
+  if entity not in EXPORTABLE_TABLES or file_format not in EXPORT_MIMETYPES:
+    abort(404)
+  chunks = exportChunks(EXPORTABLE_TABLES[entity], file_format)
+  headers = {'Content-Disposition': f'attachment; filename={entity}.{file_format}'}
+  if 'gzip' in request.accept_encodings:
+    chunks = gzipChunks(chunks)
+    headers['Content-Encoding'] = 'gzip'
+  return Response(stream_with_context(chunks), mimetype=EXPORT_MIMETYPES[file_format], headers=headers)
+
 #  Error Handlers
 #  ----------------------------------------------------------------
 
+@app.errorhandler(400)
+def bad_request_error(error):
+    if request.path.startswith('/api/'):
+        return apiError(400, error.name)
+    return error
+
 @app.errorhandler(404)
 def not_found_error(error):
+    if request.path.startswith('/api/'):
+        return apiError(404, error.name)
     return render_template('errors/404.html'), 404
 
 @app.errorhandler(500)
 def server_error(error):
+    if request.path.startswith('/api/'):
+        return apiError(500, 'Internal Server Error')
     return render_template('errors/500.html'), 500
 
 
@@ -882,6 +1583,252 @@ if not app.debug:
     app.logger.addHandler(file_handler)
     app.logger.info('errors')
 
+#----------------------------------------------------------------------------#
+# Commands.
+#----------------------------------------------------------------------------#
+
+#tables that the hot queries must reach through an index
+INDEXED_TABLES = ('shows', 'venue_genres', 'artist_genres')
+
+def explainQuery(query):
+  #returns the plan lines of the query as reported by the database
+  connection = db.session.connection()
+  compiled = query.statement.compile(dialect=connection.dialect)
+  if compiled.positional:
+    params = tuple(compiled.params[name] for name in compiled.positiontup)
+  else:
+    params = compiled.params
+  if connection.dialect.name == 'sqlite':
+    rows = connection.execute('EXPLAIN QUERY PLAN ' + str(compiled), params)
+    return [row[-1] for row in rows]
+  rows = connection.execute('EXPLAIN ' + str(compiled), params)
+  return [row[0] for row in rows]
+
+def findSequentialScans(plan):
+  scanned_tables = []
+  for line in plan:
+    #sqlite reports a scan in index order as SCAN <table> USING INDEX, it is not a full scan
+    match = re.search(r'Seq Scan on (\w+)', line) or \
+      re.match(r'SCAN (?:TABLE )?(\w+)(?!.*USING (?:COVERING )?INDEX)', line.strip())
+    if match and match.group(1) in INDEXED_TABLES:
+      scanned_tables.append(match.group(1))
+  return scanned_tables
+
+def hotQueries():
+  #the detail page queries, the ?genre= listing filters and the show listing page
+  venue_id = db.session.query(db.func.max(Show.venue_id)).scalar() or 1
+  artist_id = db.session.query(db.func.max(Show.artist_id)).scalar() or 1
+  genre_id = db.session.query(VenueGenre.genre_id).limit(1).scalar()
+  queries = {
+    'venue detail': queryEntityDetail(Venue, venue_id),
+    'venue shows': queryVenueShows(venue_id),
+    'artist detail': queryEntityDetail(Artist, artist_id),
+    'artist shows': queryArtistShows(artist_id),
+  }
+  #the listings read their filters and page size from the request
+  with app.test_request_context(query_string={'genre': genreNames([genre_id])[0]} if genre_id else {}):
+    queries['venue genre filter'] = Page(filterEntities(queryVenueListing(), Venue, VenueGenre, 'venue_id'),
+      VENUE_LISTING_ORDER, 'venues').query
+    queries['artist genre filter'] = Page(filterEntities(db.session.query(Artist.id, Artist.name), Artist, ArtistGenre, 'artist_id'),
+      (Artist.id,), 'artists').query
+    queries['show listing'] = Page(queryShowListing(), (Show.start_time, Show.id), 'shows').query
+  return queries
+
+def queryPlanScans():
+  #(scanned tables, plan) of every hot query, the tables empty when all of them go through indexes
+  return {name: (findSequentialScans(plan), plan) for name, plan in
+    ((name, explainQuery(query)) for name, query in hotQueries().items())}
+
+@app.cli.command('check-query-plans')
+def check_query_plans():
+  """Fail if the hot queries fall back to sequential scans."""
+  failures = []
+  for name, (scanned_tables, plan) in queryPlanScans().items():
+    click.echo(f'{name}: ' + ('sequential scan on ' + ', '.join(scanned_tables) if scanned_tables else 'ok'))
+    if scanned_tables:
+      failures.append(name)
+      click.echo('\n'.join('  ' + line for line in plan))
+  if failures:
+    raise click.ClickException('sequential scans in: ' + ', '.join(failures))
+
+#form used to validate the rows of each entity, its model, genre model and genre owner column
+IMPORTABLE_ENTITIES = {
+  'venues': (VenueForm, Venue, VenueGenre, 'venue_id'),
+  'artists': (ArtistForm, Artist, ArtistGenre, 'artist_id'),
+  'shows': (ShowForm, Show, None, None),
+}
+
+def readImportRows(path, file_format):
+  with open(path, newline='') as import_file:
+    if file_format == 'csv':
+      #genres of a csv row are separated by semicolons
+      for row in csv.DictReader(import_file):
+        if 'genres' in row:
+          row['genres'] = [genre for genre in (row['genres'] or '').split(';') if genre]
+        yield row
+    else:
+      for line in import_file:
+        if line.strip():
+          yield json.loads(line)
+
+#how csv files, flask export's among them, spell a false flag
+FALSE_STRINGS = ('', 'false', '0', 'no', 'n', 'off')
+
+def validateImportRow(form_class, row):
+  #runs the row through the same form the web pages use, returns (data, errors)
+  form = form_class(meta={'csrf': False})
+  flags = {field.name for field in form if isinstance(field, BooleanField)}
+  formdata = MultiDict()
+  for key, value in row.items():
+    for item in (value if isinstance(value, list) else [value]):
+      if key in flags and isinstance(item, str):
+        item = item.strip().lower() not in FALSE_STRINGS
+      if isinstance(item, bool):
+        item = 'y' if item else ''
+      if item is not None:
+        formdata.add(key, str(item))
+  #only the row supplies values, field defaults (a show's start_time of import time) never apply
+  form.process(formdata, data={field.name: None for field in form})
+  if not form.validate():
+    return None, form.errors
+  return form.data, None
+
+def insertReturningIds(table, rows):
+  #inserts the rows in one statement and returns their ids in the same order
+  connection = db.session.connection()
+  if connection.dialect.name == 'postgresql':
+    #ids are taken from the sequence up front so that each row knows its id
+    ids = [row_id for (row_id,) in connection.execute(
+      db.select([db.func.nextval(table.name + '_id_seq')]).select_from(db.func.generate_series(1, len(rows))))]
+    connection.execute(table.insert().values([dict(row, id=row_id) for row, row_id in zip(rows, ids)]))
+    return ids
+  return [connection.execute(table.insert(), row).inserted_primary_key[0] for row in rows]
+
+def showReferenceErrors(batch):
+  #errors of the show rows naming a venue or artist that does not exist, in the same form
+  #as the form errors (None for the rows that are fine), the ids are looked up in one query
+  def entityId(value):
+    return int(value) if str(value).isdigit() else None
+  venue_ids = {entityId(data['venue_id']) for data in batch} - {None}
+  artist_ids = {entityId(data['artist_id']) for data in batch} - {None}
+  existing = set(db.session.query(db.literal_column("'venue_id'").label('owner_column'), Venue.id.label('id')).
+    filter(Venue.id.in_(venue_ids)).union_all(
+    db.session.query(db.literal_column("'artist_id'"), Artist.id).filter(Artist.id.in_(artist_ids))))
+  errors = []
+  for data in batch:
+    row_errors = {column: [f'No {column[:-3]} with id {data[column]}.'] for column in ('venue_id', 'artist_id')
+      if (column, entityId(data[column])) not in existing}
+    errors.append(row_errors or None)
+  return errors
+
+def importBatch(entity, batch):
+  form_class, model, genre_model, owner_column = IMPORTABLE_ENTITIES[entity]
+  columns = formColumns(form_class(meta={'csrf': False}), model)
+  rows = [{key: data[key] for key in columns} for data in batch]
+  if genre_model is None:
+    db.session.execute(model.__table__.insert().values(rows))
+    return
+  ids = insertReturningIds(model.__table__, rows)
+  insertGenres(genre_model, owner_column, [(entity_id, data['genres']) for entity_id, data in zip(ids, batch)])
+
+@app.cli.command('import')
+@click.argument('entity', type=click.Choice(sorted(IMPORTABLE_ENTITIES)))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'file_format', type=click.Choice(['csv', 'ndjson']), help='Defaults to the file extension.')
+@click.option('--batch-size', default=1000, show_default=True, help='Rows inserted per statement.')
+def import_command(entity, path, file_format, batch_size):
+  """Bulk import venues, artists or shows from a csv or ndjson file."""
+  file_format = file_format or ('csv' if path.lower().endswith('.csv') else 'ndjson')
+  form_class, model, genre_model, owner_column = IMPORTABLE_ENTITIES[entity]
+  imported = rejected = 0
+  started = time.perf_counter()
+  batch = []
+  line_numbers = []
+  touched_keys = set()
+
+  def flush():
+    nonlocal imported, rejected
+    if entity == 'shows':
+      #shows must point at existing venues and artists, postgres would fail the whole batch
+      checked = list(zip(line_numbers, batch, showReferenceErrors(batch)))
+      batch[:] = [data for line_number, data, errors in checked if not errors]
+      for line_number, data, errors in checked:
+        if errors:
+          rejected += 1
+          click.echo(f'row {line_number} rejected: {errors}', err=True)
+    line_numbers.clear()
+    if not batch:
+      return
+    importBatch(entity, batch)
+    if entity == 'shows':
+      for counter_model, owner_column in SHOW_COUNTERS:
+        refreshShowCounters(counter_model, owner_column, {data[owner_column] for data in batch})
+    db.session.commit()
+    imported += len(batch)
+    if entity == 'shows':
+      touched_keys.update(key for data in batch for key in (f"venue:{data['venue_id']}", f"artist:{data['artist_id']}"))
+    batch.clear()
+    click.echo(f'{imported} rows imported, {imported / (time.perf_counter() - started):.0f} rows/sec')
+
+  with app.test_request_context():
+    #the inserted ids are read back, everything stays on the primary
+    g.use_primary = True
+    for line_number, row in enumerate(readImportRows(path, file_format), 1):
+      data, errors = validateImportRow(form_class, row)
+      if errors:
+        rejected += 1
+        click.echo(f'row {line_number} rejected: {errors}', err=True)
+        continue
+      batch.append(data)
+      line_numbers.append(line_number)
+      if len(batch) >= batch_size:
+        flush()
+    if batch:
+      flush()
+
+  #the inserts bypassed the ORM, so caches and search indexes are refreshed here
+  cache.invalidate(*touched_keys)
+  cache.invalidate_namespace(entity, *(['venues'] if entity == 'shows' else []))
+  if model in search_indexes:
+    search_indexes[model].clear()
+  elapsed = time.perf_counter() - started
+  click.echo(f'done: {imported} imported, {rejected} rejected in {elapsed:.1f}s ({imported / max(elapsed, 1e-9):.0f} rows/sec)')
+
+@app.cli.command('roll-show-counters')
+@click.option('--window', default=3600, show_default=True,
+  help='Seconds to look back for shows that started, keep it longer than the interval the job runs at.')
+@click.option('--all', 'recount_all', is_flag=True, help='Recount every venue and artist.')
+def roll_show_counters_command(window, recount_all):
+  """Move the shows that have started from the upcoming to the past counters."""
+  now = datetime.now()
+  for model, owner_column in SHOW_COUNTERS:
+    owner = getattr(Show, owner_column)
+    #the owners of the shows that started within the window, read off ix_shows_start_time_id
+    entity_ids = None if recount_all else db.session.query(owner).\
+      filter(Show.start_time > now - timedelta(seconds=window), Show.start_time <= now).distinct()
+    refreshShowCounters(model, owner_column, entity_ids, now)
+  db.session.commit()
+  cache.invalidate_namespace('venues')
+  click.echo(f'show counters rolled over at {now.isoformat()}')
+
+@app.cli.command('export')
+@click.argument('entity', type=click.Choice(sorted(EXPORTABLE_TABLES)))
+@click.option('--format', 'file_format', type=click.Choice(sorted(EXPORT_MIMETYPES)), default='ndjson', show_default=True)
+@click.option('--gzip', 'compress', is_flag=True, help='Compress the output with gzip.')
+@click.option('-o', '--output', type=click.Path(dir_okay=False, writable=True), help='Defaults to stdout.')
+def export_command(entity, file_format, compress, output):
+  """Export a table as ndjson or csv in constant memory."""
+  stats = {}
+  started = time.perf_counter()
+  chunks = exportChunks(EXPORTABLE_TABLES[entity], file_format, stats)
+  chunks = gzipChunks(chunks) if compress else (chunk.encode() for chunk in chunks)
+  with (open(output, 'wb') if output else click.get_binary_stream('stdout')) as export_file:
+    for chunk in chunks:
+      export_file.write(chunk)
+  elapsed = time.perf_counter() - started
+  exported = stats.get('rows', 0)
+  click.echo(f'{exported} rows exported in {elapsed:.1f}s ({exported / max(elapsed, 1e-9):.0f} rows/sec)', err=True)
+
 #----------------------------------------------------------------------------#
 # Launch.
 #----------------------------------------------------------------------------#
@@ -0,0 +1,86 @@
+import random
+from functools import lru_cache
+from datetime import datetime, timedelta
+
+# Seeded generator of venues, artists, genres and shows. Popularity follows
+# long-tailed distributions: a few big cities hold most venues, a few genres
+# most tags, and a few venues and artists most of the shows.
+
+
+CITIES = [('New York', 'NY'), ('Los Angeles', 'CA'), ('Chicago', 'IL'), ('Houston', 'TX'),
+          ('Phoenix', 'AZ'), ('Philadelphia', 'PA'), ('San Antonio', 'TX'), ('San Diego', 'CA'),
+          ('Dallas', 'TX'), ('San Francisco', 'CA'), ('Austin', 'TX'), ('Seattle', 'WA'),
+          ('Denver', 'CO'), ('Nashville', 'TN'), ('Boston', 'MA'), ('Portland', 'OR'),
+          ('Las Vegas', 'NV'), ('Detroit', 'MI'), ('Memphis', 'TN'), ('New Orleans', 'LA'),
+          ('Atlanta', 'GA'), ('Miami', 'FL'), ('Minneapolis', 'MN'), ('Kansas City', 'MO')]
+
+WORDS = ['Blue', 'Velvet', 'Golden', 'Hop', 'Wild', 'Sax', 'Musical', 'Park', 'Square', 'Live',
+         'Electric', 'Midnight', 'Neon', 'River', 'Stone', 'Echo', 'Crimson', 'Silver', 'Night',
+         'Garden', 'Harbor', 'Lantern', 'Monarch', 'Pioneer', 'Rebel', 'Sunset', 'Thunder']
+
+VENUE_KINDS = ['Hall', 'Lounge', 'Club', 'Theatre', 'Bar', 'Room', 'Arena', 'Coffee House']
+ARTIST_KINDS = ['Band', 'Trio', 'Quartet', 'Collective', 'Orchestra', 'Project', 'Ensemble']
+
+
+@lru_cache(maxsize=None)
+def zipf_weights(count, exponent=1.1):
+    return tuple(1.0 / (rank ** exponent) for rank in range(1, count + 1))
+
+
+class DataGenerator(object):
+    def __init__(self, seed=0, now=None):
+        self.random = random.Random(seed)
+        self.now = now or datetime.now().replace(second=0, microsecond=0)
+
+    def name(self, kinds):
+        return ' '.join(self.random.sample(WORDS, 2) + [self.random.choice(kinds)])
+
+    def genres(self, names, count):
+        # the form's genres first, then made-up ones when more are asked for
+        names = list(names[:count])
+        names += ['Genre {}'.format(index) for index in range(len(names) + 1, count + 1)]
+        return names
+
+    def pick_genres(self, genre_names, weights, most):
+        picked = set(self.random.choices(genre_names, weights, k=self.random.randint(1, most)))
+        return sorted(picked)
+
+    def venues(self, count, genre_names):
+        city_weights = zipf_weights(len(CITIES))
+        genre_weights = zipf_weights(len(genre_names))
+        for index in range(count):
+            city, state = self.random.choices(CITIES, city_weights)[0]
+            yield {'name': '{} {}'.format(self.name(VENUE_KINDS), index),
+                   'city': city,
+                   'state': state,
+                   'address': '{} {} St'.format(self.random.randint(1, 9999), self.random.choice(WORDS)),
+                   'phone': '{:03d}-{:03d}-{:04d}'.format(self.random.randint(200, 999), self.random.randint(0, 999), self.random.randint(0, 9999)),
+                   'seeking_talent': self.random.random() < 0.3,
+                   'genres': self.pick_genres(genre_names, genre_weights, 3)}
+
+    def artists(self, count, genre_names):
+        city_weights = zipf_weights(len(CITIES))
+        genre_weights = zipf_weights(len(genre_names))
+        for index in range(count):
+            city, state = self.random.choices(CITIES, city_weights)[0]
+            yield {'name': '{} {}'.format(self.name(ARTIST_KINDS), index),
+                   'city': city,
+                   'state': state,
+                   'seeking_venue': self.random.random() < 0.3,
+                   'genres': self.pick_genres(genre_names, genre_weights, 2)}
+
+    def start_time(self):
+        # a year either side of now, mostly evenings and more of them on weekends
+        day = self.now.date() + timedelta(days=self.random.randint(-365, 365))
+        while day.weekday() < 4 and self.random.random() < 0.5:
+            day += timedelta(days=1)
+        return datetime(day.year, day.month, day.day, self.random.choice([18, 19, 20, 20, 21, 21, 22]),
+                        self.random.choice([0, 0, 30]))
+
+    def shows(self, count, venue_ids, artist_ids):
+        venue_weights = zipf_weights(len(venue_ids), 0.8)
+        artist_weights = zipf_weights(len(artist_ids), 0.8)
+        venues = self.random.choices(venue_ids, venue_weights, k=count)
+        artists = self.random.choices(artist_ids, artist_weights, k=count)
+        for venue_id, artist_id in zip(venues, artists):
+            yield {'venue_id': venue_id, 'artist_id': artist_id, 'start_time': self.start_time()}
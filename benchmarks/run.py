@@ -0,0 +1,343 @@
+"""Benchmark harness: seeds a scratch database with generated data of growing
+size, runs a seeded mix of requests through the Flask test client and reports
+p50/p95/p99 latency and SQL statements per request for every scenario.
+The run fails when a request errors or, on the largest size, when a hot query
+plans a sequential scan of the shows or genre tables.
+
+    python -m benchmarks.run --sizes 100 1000 10000 --requests 500
+    python -m benchmarks.run --sizes 100 --export-shows 1000000
+
+Results are written to benchmarks/results/ as JSON, one file per run, named
+after the time and the commit so that runs can be compared across commits.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.datagen import CITIES, WORDS, DataGenerator, zipf_weights
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+# (scenario, weight) of the request mix, read-heavy like the real traffic
+SCENARIOS = [('venue listing', 15), ('artist listing', 8), ('show listing', 10), ('genre facet', 5),
+             ('venue detail', 20), ('artist detail', 15), ('venue search', 8), ('show search', 10),
+             ('api venue', 5), ('create show', 4), ('create venue', 2)]
+
+
+def percentile(values, fraction):
+    # nearest-rank percentile
+    ordered = sorted(values)
+    return ordered[max(int(round(fraction * len(ordered))) - 1, 0)]
+
+
+def commit_id():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def legacy_format_datetime(value, format='medium'):
+    # the datetime filter as it was before it took datetimes and memoized, for comparison
+    import babel.dates
+    import dateutil.parser
+    date = dateutil.parser.parse(value)
+    if format == 'full':
+        format = "EEEE MMMM, d, y 'at' h:mma"
+    elif format == 'medium':
+        format = "EE MM, dd, y h:mma"
+    return babel.dates.format_datetime(date, format, locale='en')
+
+
+def format_datetime_micro(fyyur, count=5000, seed=0):
+    generator = DataGenerator(seed)
+    times = [generator.start_time() for _ in range(count)]
+    started = time.perf_counter()
+    for value in times:
+        legacy_format_datetime(str(value), 'full')
+    legacy = time.perf_counter() - started
+    fyyur.formatDatetime.cache_clear()
+    started = time.perf_counter()
+    for value in times:
+        fyyur.format_datetime(value, 'full')
+    current = time.perf_counter() - started
+    return {'values': count, 'distinct': len(set(times)),
+            'legacy_ms': round(legacy * 1000, 2), 'current_ms': round(current * 1000, 2)}
+
+
+def legacy_create_venue(fyyur, venue):
+    # the create path as it was before user-011: the new id is looked up again and
+    # every genre is a separate INSERT
+    db = fyyur.db
+    db.session.add(fyyur.Venue(**{key: value for key, value in venue.items() if key != 'genres'}))
+    latest_venue = fyyur.Venue.query.order_by(fyyur.Venue.id.desc()).first()
+    for genre_id in fyyur.genreIds(venue['genres']):
+        db.session.add(fyyur.VenueGenre(genre_id=genre_id, venue_id=latest_venue.id))
+    db.session.commit()
+
+
+def current_create_venue(fyyur, venue):
+    # the statements of create_venue_submission
+    db = fyyur.db
+    new_venue = fyyur.Venue(**{key: value for key, value in venue.items() if key != 'genres'})
+    db.session.add(new_venue)
+    db.session.flush()
+    fyyur.insertGenres(fyyur.VenueGenre, 'venue_id', [(new_venue.id, venue['genres'])])
+    db.session.commit()
+
+
+def create_venue_micro(fyyur, genre_names, statement_counter, count=200, seed=0):
+    # SQL statements and time per created venue, before and after user-011. The legacy
+    # genre INSERTs count as one executemany, which psycopg2 still sends row by row
+    venues = list(DataGenerator(seed).venues(count, genre_names))
+    report = {'venues': count, 'genres_mean': round(sum(len(venue['genres']) for venue in venues) / count, 2)}
+    for name, create in (('legacy', legacy_create_venue), ('current', current_create_venue)):
+        statements_before = statement_counter[0]
+        started = time.perf_counter()
+        for venue in venues:
+            create(fyyur, venue)
+        report[name + '_ms'] = round((time.perf_counter() - started) * 1000 / count, 3)
+        report[name + '_statements'] = round((statement_counter[0] - statements_before) / count, 2)
+    return report
+
+
+def export_benchmark(fyyur, shows, seed=0):
+    # rows/sec of exportChunks over the shows table, per format, plain and gzipped
+    reset_database(fyyur)
+    venues = min(1000, shows)
+    counts, ids, genre_names = seed_database(fyyur, venues, max(shows // venues, 1), 19, seed)
+    report = {'shows': counts['shows'], 'formats': {}}
+    for file_format in ('ndjson', 'csv'):
+        for compress in (False, True):
+            stats = {}
+            size = 0
+            started = time.perf_counter()
+            chunks = fyyur.exportChunks(fyyur.Show.__table__, file_format, stats)
+            for chunk in (fyyur.gzipChunks(chunks) if compress else (chunk.encode() for chunk in chunks)):
+                size += len(chunk)
+            elapsed = time.perf_counter() - started
+            fyyur.db.session.rollback()
+            report['formats'][file_format + ('.gz' if compress else '')] = {
+                'rows': stats.get('rows', 0), 'seconds': round(elapsed, 3), 'bytes': size,
+                'rows_per_sec': round(stats.get('rows', 0) / max(elapsed, 1e-9))}
+    return report
+
+
+def check_query_plans(fyyur):
+    # the hot queries must not scan the shows and genre tables on the seeded data,
+    # returns the scanned tables of every query
+    if fyyur.db.engine.dialect.name == 'postgresql':
+        fyyur.db.session.execute('ANALYZE')
+    plans = {}
+    print()
+    for name, (scanned_tables, plan) in fyyur.queryPlanScans().items():
+        plans[name] = scanned_tables
+        print('query plan {}: {}'.format(name, 'sequential scan on ' + ', '.join(scanned_tables) if scanned_tables else 'ok'))
+        if scanned_tables:
+            print('\n'.join('  ' + line for line in plan))
+    fyyur.db.session.rollback()
+    return plans
+
+
+def reset_database(fyyur):
+    db = fyyur.db
+    db.drop_all()
+    if db.engine.dialect.name == 'postgresql':
+        db.session.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        db.session.commit()
+    db.create_all()
+    fyyur.cache.clear()
+    for search_index in fyyur.search_indexes.values():
+        search_index.clear()
+    fyyur.genres_by_name.clear()
+    fyyur.genres_by_id.clear()
+
+
+def seed_database(fyyur, size, shows_per_venue, genre_count, seed):
+    # size venues and size artists, size * shows_per_venue shows
+    db = fyyur.db
+    generator = DataGenerator(seed)
+    genre_names = generator.genres([name for name, label in fyyur.genre_choices], genre_count)
+    db.session.execute(fyyur.Genre.__table__.insert().values([{'name': name} for name in genre_names]))
+    fyyur.loadGenres()
+
+    ids = {}
+    for model, genre_model, owner_column, rows in (
+            (fyyur.Venue, fyyur.VenueGenre, 'venue_id', generator.venues(size, genre_names)),
+            (fyyur.Artist, fyyur.ArtistGenre, 'artist_id', generator.artists(size, genre_names))):
+        rows = list(rows)
+        ids[model] = fyyur.insertReturningIds(model.__table__, [
+            {key: value for key, value in row.items() if key != 'genres'} for row in rows])
+        fyyur.insertGenres(genre_model, owner_column, [(entity_id, row['genres']) for entity_id, row in zip(ids[model], rows)])
+
+    shows = list(generator.shows(size * shows_per_venue, ids[fyyur.Venue], ids[fyyur.Artist]))
+    for start in range(0, len(shows), 1000):
+        db.session.execute(fyyur.Show.__table__.insert().values(shows[start:start + 1000]))
+    for model, owner_column in fyyur.SHOW_COUNTERS:
+        fyyur.refreshShowCounters(model, owner_column)
+    db.session.commit()
+    return {'venues': size, 'artists': size, 'shows': len(shows), 'genres': len(genre_names)}, ids, genre_names
+
+
+def scenario_request(scenario, rng, ids, genre_names, fyyur):
+    # (method, url, form data) of one request of the scenario; popular entities are hit more
+    venue_ids, artist_ids = ids[fyyur.Venue], ids[fyyur.Artist]
+    if scenario == 'venue listing':
+        return 'GET', '/venues', None
+    if scenario == 'artist listing':
+        return 'GET', '/artists', None
+    if scenario == 'show listing':
+        return 'GET', '/shows', None
+    if scenario == 'genre facet':
+        return 'GET', '/venues?genre=' + rng.choice(genre_names[:8]), None
+    if scenario == 'venue detail':
+        return 'GET', '/venues/{}'.format(rng.choices(venue_ids, zipf_weights(len(venue_ids), 0.8))[0]), None
+    if scenario == 'artist detail':
+        return 'GET', '/artists/{}'.format(rng.choices(artist_ids, zipf_weights(len(artist_ids), 0.8))[0]), None
+    if scenario == 'venue search':
+        return 'POST', '/venues/search', {'search_term': rng.choice(WORDS).lower()}
+    if scenario == 'show search':
+        start = datetime.now().date() + timedelta(days=rng.randint(0, 60))
+        city, state = rng.choice(CITIES[:8])
+        return 'GET', '/shows/search?city={}&from={}&to={}'.format(
+            city.replace(' ', '+'), start.isoformat(), (start + timedelta(days=2)).isoformat()), None
+    if scenario == 'api venue':
+        return 'GET', '/api/v1/venues/{}?fields=id,name,upcoming_shows_count'.format(rng.choice(venue_ids)), None
+    if scenario == 'create show':
+        start = datetime.now() + timedelta(days=rng.randint(1, 90))
+        return 'POST', '/shows/create', {'venue_id': str(rng.choice(venue_ids)), 'artist_id': str(rng.choice(artist_ids)),
+                                         'start_time': start.strftime('%Y-%m-%d %H:%M:%S')}
+    if scenario == 'create venue':
+        venue = next(DataGenerator(rng.random()).venues(1, genre_names))
+        return 'POST', '/venues/create', dict(venue, seeking_talent='y' if venue['seeking_talent'] else '')
+    raise ValueError(scenario)
+
+
+def run_mix(fyyur, client, requests, ids, genre_names, seed, statement_counter):
+    rng = random.Random(seed)
+    names = [name for name, weight in SCENARIOS]
+    weights = [weight for name, weight in SCENARIOS]
+    samples = {name: {'latency_ms': [], 'statements': [], 'errors': 0} for name in names}
+    for scenario in rng.choices(names, weights, k=requests):
+        method, url, data = scenario_request(scenario, rng, ids, genre_names, fyyur)
+        statements_before = statement_counter[0]
+        started = time.perf_counter()
+        response = client.open(url, method=method, data=data)
+        response.get_data()
+        elapsed = time.perf_counter() - started
+        response.close()
+        samples[scenario]['latency_ms'].append(elapsed * 1000)
+        samples[scenario]['statements'].append(statement_counter[0] - statements_before)
+        if response.status_code >= 500:
+            samples[scenario]['errors'] += 1
+
+    report = {}
+    for name, sample in samples.items():
+        if not sample['latency_ms']:
+            continue
+        latencies = sample['latency_ms']
+        report[name] = {'requests': len(latencies),
+                        'errors': sample['errors'],
+                        'p50_ms': round(percentile(latencies, 0.50), 2),
+                        'p95_ms': round(percentile(latencies, 0.95), 2),
+                        'p99_ms': round(percentile(latencies, 0.99), 2),
+                        'statements_mean': round(sum(sample['statements']) / len(latencies), 2),
+                        'statements_max': max(sample['statements'])}
+    return report
+
+
+def print_report(size, counts, report):
+    print('\n{venues} venues, {artists} artists, {shows} shows'.format(**counts))
+    print('{:<16}{:>9}{:>7}{:>10}{:>10}{:>10}{:>10}{:>9}'.format(
+        'scenario', 'requests', 'errors', 'p50 ms', 'p95 ms', 'p99 ms', 'queries', 'max q'))
+    for name, row in report.items():
+        print('{:<16}{requests:>9}{errors:>7}{p50_ms:>10}{p95_ms:>10}{p99_ms:>10}{statements_mean:>10}{statements_max:>9}'.format(name, **row))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000], help='venues (and artists) per run')
+    parser.add_argument('--shows-per-venue', type=int, default=5)
+    parser.add_argument('--genres', type=int, default=19)
+    parser.add_argument('--requests', type=int, default=500, help='requests per size')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--export-shows', type=int, default=100000, help='shows in the export benchmark, 0 skips it')
+    parser.add_argument('--no-cache', action='store_true', help='run without the page cache')
+    parser.add_argument('--database-url', help='scratch database to use, its tables are dropped (default: a temporary sqlite file)')
+    parser.add_argument('--output', help='result file (default: benchmarks/results/<time>-<commit>.json)')
+    args = parser.parse_args(argv)
+
+    # the app reads its configuration on import
+    os.environ['DATABASE_URL'] = args.database_url or 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'benchmark.db')
+    os.environ.pop('DATABASE_REPLICA_URLS', None)
+    os.environ.pop('METRICS_DIR', None)
+    import app as fyyur
+    from cache import LRUCache
+
+    fyyur.app.config['WTF_CSRF_ENABLED'] = False
+    fyyur.app.logger.setLevel(logging.WARNING)
+    if args.no_cache:
+        fyyur.cache.backend = LRUCache(max_entries=0)
+    statement_counter = [0]
+
+    @fyyur.event.listens_for(fyyur.Engine, 'before_cursor_execute')
+    def count_statement(conn, cursor, statement, parameters, context, executemany):
+        statement_counter[0] += 1
+
+    results = {'commit': commit_id(),
+               'started_at': datetime.utcnow().isoformat(),
+               'python': platform.python_version(),
+               'seed': args.seed,
+               'requests_per_size': args.requests,
+               'cache': not args.no_cache,
+               'runs': []}
+    failed = False
+    for size in args.sizes:
+        with fyyur.app.app_context():
+            reset_database(fyyur)
+            results['database'] = fyyur.db.engine.dialect.name
+            counts, ids, genre_names = seed_database(fyyur, size, args.shows_per_venue, args.genres, args.seed)
+        report = run_mix(fyyur, fyyur.app.test_client(), args.requests, ids, genre_names, args.seed, statement_counter)
+        print_report(size, counts, report)
+        failed = failed or any(row['errors'] for row in report.values())
+        results['runs'].append({'size': size, 'counts': counts, 'scenarios': report})
+        if size == max(args.sizes):
+            with fyyur.app.app_context():
+                results['query_plans'] = check_query_plans(fyyur)
+            failed = failed or any(results['query_plans'].values())
+
+    with fyyur.app.app_context():
+        results['micro'] = {'format_datetime': format_datetime_micro(fyyur, seed=args.seed),
+                            'create_venue': create_venue_micro(fyyur, genre_names, statement_counter, seed=args.seed)}
+    print('\nformat_datetime: {values} values, legacy {legacy_ms} ms, current {current_ms} ms'.format(
+        **results['micro']['format_datetime']))
+    print('create venue: {genres_mean} genres on average, legacy {legacy_statements} statements {legacy_ms} ms, '
+          'current {current_statements} statements {current_ms} ms per venue'.format(**results['micro']['create_venue']))
+
+    if args.export_shows:
+        with fyyur.app.app_context():
+            results['export'] = export_benchmark(fyyur, args.export_shows, seed=args.seed)
+        print('\nexport of {} shows'.format(results['export']['shows']))
+        for name, row in results['export']['formats'].items():
+            print('{:<10}{rows_per_sec:>10} rows/sec{seconds:>9} s{bytes:>12} bytes'.format(name, **row))
+
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, '{}-{}.json'.format(datetime.utcnow().strftime('%Y%m%dT%H%M%S'), results['commit']))
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print('results written to ' + output)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
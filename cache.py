@@ -0,0 +1,150 @@
+import pickle
+import threading
+import time
+from collections import Counter, OrderedDict
+
+# Page payload cache with pluggable backends
+
+
+MISSING = object()
+
+# ttl for bookkeeping entries that must outlive every page entry
+NEVER_EXPIRES = 10 * 365 * 24 * 3600
+
+
+class LRUCache(object):
+    # in-process backend, least recently used entries are evicted first
+    shared = False
+
+    def __init__(self, max_entries=10000, default_ttl=None):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key, MISSING)
+            if entry is MISSING:
+                return MISSING
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.time():
+                del self._entries[key]
+                return MISSING
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.default_ttl if ttl is None else ttl
+        expires_at = time.time() + ttl if ttl is not None else None
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class RedisCache(object):
+    # backend for a local Redis (or Redis-compatible) server shared by all workers
+    shared = True
+
+    def __init__(self, url, default_ttl=None, prefix='fyyur:'):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('the redis cache backend requires the "redis" package')
+        self.client = redis.Redis.from_url(url)
+        self.default_ttl = default_ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        if value is None:
+            return MISSING
+        return pickle.loads(value)
+
+    def set(self, key, value, ttl=None):
+        ttl = self.default_ttl if ttl is None else ttl
+        if ttl is not None and ttl <= 0:
+            # already expired, Redis rejects a zero expire time
+            return
+        self.client.set(self.prefix + key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL),
+                        px=max(1, int(ttl * 1000)) if ttl is not None else None)
+
+    def delete(self, *keys):
+        if keys:
+            self.client.delete(*[self.prefix + key for key in keys])
+
+    def clear(self):
+        keys = list(self.client.scan_iter(self.prefix + '*'))
+        if keys:
+            self.client.delete(*keys)
+
+
+class Cache(object):
+    def __init__(self, backend, accept_writes=None):
+        self.backend = backend
+        # optional callable, set() stores nothing while it returns False
+        self.accept_writes = accept_writes
+        self.hits = Counter()
+        self.misses = Counter()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        value = self.backend.get(key)
+        # hits and misses are counted per kind of page, the part of the key before ':'
+        kind = key.split(':', 1)[0]
+        with self._lock:
+            if value is MISSING:
+                self.misses[kind] += 1
+            else:
+                self.hits[kind] += 1
+        return value
+
+    def set(self, key, value, ttl=None):
+        if self.accept_writes is not None and not self.accept_writes():
+            return
+        self.backend.set(key, value, ttl)
+
+    def generation(self, namespace):
+        # changes whenever the namespace is invalidated
+        generation = self.backend.get('generation:' + namespace)
+        if generation is MISSING:
+            generation = time.time_ns()
+            self.backend.set('generation:' + namespace, generation, ttl=NEVER_EXPIRES)
+        return generation
+
+    def namespace_key(self, namespace, suffix):
+        # keys of paginated pages carry the namespace generation, bumping the
+        # generation invalidates every page of the namespace at once
+        return f'{namespace}:{self.generation(namespace)}:{suffix}'
+
+    def invalidate(self, *keys):
+        self.backend.delete(*keys)
+
+    def invalidate_namespace(self, *namespaces):
+        for namespace in namespaces:
+            self.backend.set('generation:' + namespace, time.time_ns(), ttl=NEVER_EXPIRES)
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        with self._lock:
+            kinds = set(self.hits) | set(self.misses)
+            return {kind: {'hits': self.hits[kind], 'misses': self.misses[kind]} for kind in sorted(kinds)}
+
+
+def backend_from_config(config):
+    if config.get('CACHE_BACKEND') == 'redis':
+        return RedisCache(config['CACHE_REDIS_URL'], default_ttl=config.get('CACHE_DEFAULT_TTL'))
+    return LRUCache(max_entries=config.get('CACHE_MAX_ENTRIES', 10000), default_ttl=config.get('CACHE_DEFAULT_TTL'))
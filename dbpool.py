@@ -0,0 +1,110 @@
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.pool import NullPool, QueuePool
+
+# Connection pool settings and checkout metrics
+
+
+class PoolStats(object):
+    # counters shared by every pool of the process, the primary's and the replicas'
+    def __init__(self):
+        self.size = 0
+        self.checked_out = 0
+        self.max_checked_out = 0
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def add_capacity(self, connections):
+        with self._lock:
+            self.size += connections
+
+    def observe_wait(self, seconds, timed_out=False):
+        with self._lock:
+            self.wait_seconds += seconds
+            self.max_wait_seconds = max(self.max_wait_seconds, seconds)
+            if timed_out:
+                self.timeouts += 1
+
+    def checkout(self):
+        with self._lock:
+            self.checkouts += 1
+            self.checked_out += 1
+            self.max_checked_out = max(self.max_checked_out, self.checked_out)
+
+    def checkin(self):
+        with self._lock:
+            self.checked_out -= 1
+
+    def snapshot(self):
+        with self._lock:
+            return {'size': self.size,
+                    'checked_out': self.checked_out,
+                    'max_checked_out': self.max_checked_out,
+                    # share of the pool (overflow included) in use, 1.0 means requests queue for connections
+                    'saturation': self.checked_out / self.size if self.size else None,
+                    'checkouts': self.checkouts,
+                    'timeouts': self.timeouts,
+                    'wait_seconds': self.wait_seconds,
+                    'max_wait_seconds': self.max_wait_seconds}
+
+
+pool_stats = PoolStats()
+
+
+class InstrumentedQueuePool(QueuePool):
+    # QueuePool that times how long each checkout waited for a free connection.
+    # Every engine's pool adds its connections (overflow included) to the size
+    def __init__(self, creator, pool_size=5, max_overflow=10, **kw):
+        super(InstrumentedQueuePool, self).__init__(creator, pool_size=pool_size, max_overflow=max_overflow, **kw)
+        self._capacity = pool_size + max(max_overflow, 0)
+        pool_stats.add_capacity(self._capacity)
+
+    def recreate(self):
+        # engine.dispose() replaces the pool with a copy of it
+        pool = super(InstrumentedQueuePool, self).recreate()
+        pool_stats.add_capacity(-self._capacity)
+        return pool
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super(InstrumentedQueuePool, self)._do_get()
+        except Exception:
+            pool_stats.observe_wait(time.perf_counter() - started, timed_out=True)
+            raise
+        pool_stats.observe_wait(time.perf_counter() - started)
+        return connection
+
+
+def engine_options_from_config(config):
+    # SQLALCHEMY_ENGINE_OPTIONS for the DB_POOL_* settings. With DB_PGBOUNCER the
+    # connections go through pgbouncer in transaction pooling mode: pgbouncer owns the
+    # pool, so connections are not kept open here (NullPool) and nothing may rely on
+    # state outliving a transaction. psycopg2 sends plain statements, it never
+    # prepares them server-side. SQLite keeps SQLAlchemy's own pool: its connections
+    # cannot move between threads, and opening a file costs next to nothing.
+    if config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+        return {}
+    if config.get('DB_PGBOUNCER'):
+        return {'poolclass': NullPool}
+    return {'poolclass': InstrumentedQueuePool,
+            'pool_size': config['DB_POOL_SIZE'],
+            'max_overflow': config['DB_MAX_OVERFLOW'],
+            'pool_timeout': config['DB_POOL_TIMEOUT'],
+            'pool_recycle': config['DB_POOL_RECYCLE'],
+            'pool_pre_ping': config['DB_POOL_PRE_PING']}
+
+
+@event.listens_for(InstrumentedQueuePool, 'checkout')
+def count_checkout(dbapi_connection, connection_record, connection_proxy):
+    pool_stats.checkout()
+
+
+@event.listens_for(InstrumentedQueuePool, 'checkin')
+def count_checkin(dbapi_connection, connection_record):
+    pool_stats.checkin()
@@ -6,8 +6,9 @@ from fabric.contrib.console import confirm
 
 def test():
     with settings(warn_only=True):
+        # the tests, then a small benchmark run that fails when any request errors
         result = local(
-            "python test_tasks.py -v && python test_users.py -v", capture=True
+            "python -m pytest -q && python -m benchmarks.run --sizes 100 --requests 200", capture=True
         )
     if result.failed and not confirm("Tests failed. Continue?"):
         abort("Aborted at user request.")
@@ -40,7 +41,7 @@ def heroku():
 
 def heroku_test():
     local(
-        "heroku run python test_tasks.py -v && heroku run python test_users.py -v"
+        "heroku run python -m benchmarks.run --sizes 100 --requests 200"
     )
 
 
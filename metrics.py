@@ -0,0 +1,161 @@
+import glob
+import json
+import os
+import threading
+import time
+
+# In-process counters and histograms rendered in the Prometheus text format.
+# Under several worker processes (gunicorn) each process writes its samples to
+# its own file in a shared directory and /metrics adds all of them up.
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{escape_label(value)}"' for name, value in pairs) + '}'
+
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class Metrics(object):
+    def __init__(self, prefix='', directory=None, flush_interval=1.0, buckets=DEFAULT_BUCKETS):
+        self.prefix = prefix
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.buckets = buckets
+        self._counters = {}
+        self._histograms = {}
+        self._collectors = []
+        self._ratios = []
+        self._last_flush = 0.0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted((label, str(label_value)) for label, label_value in labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted((label, str(label_value)) for label, label_value in labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                # one count per bucket, then the sum and the count of the observations
+                histogram = self._histograms[key] = [0] * len(self.buckets) + [0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram[index] += 1
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    def collector(self, f):
+        # f() is sampled whenever metrics are written out and returns
+        # (kind, name, labels, value) tuples, kind being 'counter' or 'gauge'
+        self._collectors.append(f)
+        return f
+
+    def ratio(self, name, numerator, denominator_extra):
+        # gauge numerator / (numerator + denominator_extra) per label set, from the summed counters
+        self._ratios.append((name, numerator, denominator_extra))
+
+    def snapshot(self):
+        with self._lock:
+            samples = {'counter': [[name, list(labels), value] for (name, labels), value in self._counters.items()],
+                       'gauge': [],
+                       'histogram': [[name, list(labels), list(values)] for (name, labels), values in self._histograms.items()]}
+        for collect in self._collectors:
+            for kind, name, labels, value in collect():
+                samples[kind].append([name, sorted((label, str(label_value)) for label, label_value in labels.items()), value])
+        return samples
+
+    def flush(self, force=False):
+        # writes the samples of this process for the other workers' /metrics, one
+        # thread at a time; the scrape's forced flush waits for a running one
+        if self.directory is None:
+            return
+        if not self._flush_lock.acquire(blocking=force):
+            return
+        try:
+            now = time.monotonic()
+            if not force and now - self._last_flush < self.flush_interval:
+                return
+            self._last_flush = now
+            path = os.path.join(self.directory, f'{os.getpid()}.json')
+            tmp_path = f'{path}.{threading.get_ident()}.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(self.snapshot(), f)
+            os.replace(tmp_path, path)
+        finally:
+            self._flush_lock.release()
+
+    def collect_processes(self):
+        if self.directory is None:
+            return [self.snapshot()]
+        self.flush(force=True)
+        snapshots = []
+        for path in glob.glob(os.path.join(self.directory, '*.json')):
+            try:
+                with open(path) as f:
+                    samples = json.load(f)
+            except (OSError, ValueError):
+                continue
+            # counters of exited workers still count, their gauges are gone
+            if not process_alive(int(os.path.basename(path)[:-len('.json')])):
+                samples['gauge'] = []
+            snapshots.append(samples)
+        return snapshots
+
+    def render(self):
+        merged = {'counter': {}, 'gauge': {}, 'histogram': {}}
+        for samples in self.collect_processes():
+            for kind in ('counter', 'gauge'):
+                for name, labels, value in samples[kind]:
+                    key = (name, tuple(tuple(pair) for pair in labels))
+                    merged[kind][key] = merged[kind].get(key, 0) + value
+            for name, labels, values in samples['histogram']:
+                key = (name, tuple(tuple(pair) for pair in labels))
+                total = merged['histogram'].setdefault(key, [0] * len(values))
+                merged['histogram'][key] = [a + b for a, b in zip(total, values)]
+
+        for name, numerator, denominator_extra in self._ratios:
+            for (counter_name, labels), value in list(merged['counter'].items()):
+                if counter_name == numerator:
+                    total = value + merged['counter'].get((denominator_extra, labels), 0)
+                    merged['gauge'][(name, labels)] = value / total if total else 0.0
+
+        lines = []
+        for kind in ('counter', 'gauge', 'histogram'):
+            for name in sorted({name for name, labels in merged[kind]}):
+                full_name = self.prefix + name
+                lines.append(f'# TYPE {full_name} {kind}')
+                for (sample_name, labels), value in sorted(merged[kind].items()):
+                    if sample_name != name:
+                        continue
+                    if kind != 'histogram':
+                        lines.append(f'{full_name}{format_labels(labels)} {value}')
+                        continue
+                    for bound, count in zip(self.buckets, value):
+                        lines.append(f'{full_name}_bucket{format_labels(labels, [("le", bound)])} {count}')
+                    lines.append(f'{full_name}_bucket{format_labels(labels, [("le", "+Inf")])} {value[-1]}')
+                    lines.append(f'{full_name}_sum{format_labels(labels)} {value[-2]}')
+                    lines.append(f'{full_name}_count{format_labels(labels)} {value[-1]}')
+        return '\n'.join(lines) + '\n'
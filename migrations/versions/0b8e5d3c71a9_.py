@@ -0,0 +1,32 @@
+"""add updated_at columns
+
+Revision ID: 0b8e5d3c71a9
+Revises: f4a19c0e2d57
+Create Date: 2026-10-18 15:47:29.118034
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0b8e5d3c71a9'
+down_revision = 'f4a19c0e2d57'
+branch_labels = None
+depends_on = None
+
+TABLES = ['venues', 'artists', 'shows']
+
+
+def upgrade():
+    # existing rows count as modified now, the application maintains the column from here on.
+    # The column holds UTC like the application's writes, not the session's local now()
+    for table in TABLES:
+        op.add_column(table, sa.Column('updated_at', sa.DateTime(), server_default=sa.text("timezone('utc', now())"), nullable=False))
+        op.create_index(op.f('ix_{}_updated_at'.format(table)), table, ['updated_at'], unique=False)
+
+
+def downgrade():
+    for table in reversed(TABLES):
+        op.drop_index(op.f('ix_{}_updated_at'.format(table)), table_name=table)
+        op.drop_column(table, 'updated_at')
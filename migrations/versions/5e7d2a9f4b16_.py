@@ -0,0 +1,36 @@
+"""add denormalized show counters
+
+Revision ID: 5e7d2a9f4b16
+Revises: 0b8e5d3c71a9
+Create Date: 2026-10-18 16:20:43.775160
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e7d2a9f4b16'
+down_revision = '0b8e5d3c71a9'
+branch_labels = None
+depends_on = None
+
+OWNERS = [('venues', 'venue_id'), ('artists', 'artist_id')]
+
+
+def upgrade():
+    for table, owner_column in OWNERS:
+        op.add_column(table, sa.Column('upcoming_shows_count', sa.Integer(), server_default='0', nullable=False))
+        op.add_column(table, sa.Column('past_shows_count', sa.Integer(), server_default='0', nullable=False))
+        # start_time is stored as local time without a time zone, hence LOCALTIMESTAMP
+        op.execute(
+            'UPDATE {table} SET '
+            'upcoming_shows_count = (SELECT count(*) FROM shows WHERE shows.{owner} = {table}.id AND shows.start_time > LOCALTIMESTAMP), '
+            'past_shows_count = (SELECT count(*) FROM shows WHERE shows.{owner} = {table}.id AND shows.start_time <= LOCALTIMESTAMP)'
+            .format(table=table, owner=owner_column))
+
+
+def downgrade():
+    for table, owner_column in reversed(OWNERS):
+        op.drop_column(table, 'past_shows_count')
+        op.drop_column(table, 'upcoming_shows_count')
@@ -0,0 +1,30 @@
+"""add show and genre lookup indexes
+
+Revision ID: 7e1c0a4d9b52
+Revises: 629293bfd0f5
+Create Date: 2026-10-18 10:12:41.208531
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7e1c0a4d9b52'
+down_revision = '629293bfd0f5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_shows_venue_id_start_time', 'shows', ['venue_id', 'start_time'], unique=False)
+    op.create_index('ix_shows_artist_id_start_time', 'shows', ['artist_id', 'start_time'], unique=False)
+    op.create_index(op.f('ix_venue_genres_venue_id'), 'venue_genres', ['venue_id'], unique=False)
+    op.create_index(op.f('ix_artist_genres_artist_id'), 'artist_genres', ['artist_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_artist_genres_artist_id'), table_name='artist_genres')
+    op.drop_index(op.f('ix_venue_genres_venue_id'), table_name='venue_genres')
+    op.drop_index('ix_shows_artist_id_start_time', table_name='shows')
+    op.drop_index('ix_shows_venue_id_start_time', table_name='shows')
@@ -0,0 +1,27 @@
+"""add trigram indexes for name search
+
+Revision ID: a3f58d21c6e7
+Revises: 7e1c0a4d9b52
+Create Date: 2026-10-18 11:03:17.552904
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3f58d21c6e7'
+down_revision = '7e1c0a4d9b52'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.create_index('ix_venues_name_trgm', 'venues', ['name'], unique=False, postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'})
+    op.create_index('ix_artists_name_trgm', 'artists', ['name'], unique=False, postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'})
+
+
+def downgrade():
+    op.drop_index('ix_artists_name_trgm', table_name='artists')
+    op.drop_index('ix_venues_name_trgm', table_name='venues')
@@ -0,0 +1,26 @@
+"""add indexes for keyset pagination
+
+Revision ID: d94b7f3e1a08
+Revises: a3f58d21c6e7
+Create Date: 2026-10-18 11:46:05.914370
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd94b7f3e1a08'
+down_revision = 'a3f58d21c6e7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_venues_state_city_id', 'venues', ['state', 'city', 'id'], unique=False)
+    op.create_index('ix_shows_start_time_id', 'shows', ['start_time', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_shows_start_time_id', table_name='shows')
+    op.drop_index('ix_venues_state_city_id', table_name='venues')
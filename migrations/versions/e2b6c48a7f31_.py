@@ -0,0 +1,71 @@
+"""move genres to a lookup table
+
+Revision ID: e2b6c48a7f31
+Revises: d94b7f3e1a08
+Create Date: 2026-10-18 13:21:54.087126
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2b6c48a7f31'
+down_revision = 'd94b7f3e1a08'
+branch_labels = None
+depends_on = None
+
+# genres offered by the venue and artist forms, in the order they are listed
+DEFAULT_GENRES = ['Alternative', 'Blues', 'Classical', 'Country', 'Electronic', 'Folk', 'Funk',
+    'Hip-Hop', 'Heavy Metal', 'Instrumental', 'Jazz', 'Musical Theatre', 'Pop', 'Punk', 'R&B',
+    'Reggae', 'Rock n Roll', 'Soul', 'Other']
+
+OWNERS = [('venue_genres', 'venue_id'), ('artist_genres', 'artist_id')]
+
+
+def upgrade():
+    genres = op.create_table('genres',
+    sa.Column('id', sa.SmallInteger(), nullable=False),
+    sa.Column('name', sa.String(length=50), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('name')
+    )
+    op.bulk_insert(genres, [{'name': name} for name in DEFAULT_GENRES])
+    # genres stored by earlier versions that are not in the forms any more
+    op.execute('''
+        INSERT INTO genres (name)
+        SELECT DISTINCT name FROM (SELECT name FROM venue_genres UNION SELECT name FROM artist_genres) AS used
+        WHERE name NOT IN (SELECT name FROM genres)
+    ''')
+
+    for table, owner_column in OWNERS:
+        op.add_column(table, sa.Column('genre_id', sa.SmallInteger(), nullable=True))
+        op.execute(f'UPDATE {table} SET genre_id = genres.id FROM genres WHERE genres.name = {table}.name')
+        op.execute(f'''
+            DELETE FROM {table} duplicate USING {table} kept
+            WHERE duplicate.{owner_column} = kept.{owner_column}
+            AND duplicate.genre_id = kept.genre_id AND duplicate.id > kept.id
+        ''')
+        op.alter_column(table, 'genre_id', existing_type=sa.SmallInteger(), nullable=False)
+        op.drop_index(f'ix_{table}_{owner_column}', table_name=table)
+        op.drop_constraint(f'{table}_pkey', table, type_='primary')
+        op.drop_column(table, 'id')
+        op.drop_column(table, 'name')
+        op.create_primary_key(f'{table}_pkey', table, [owner_column, 'genre_id'])
+        op.create_foreign_key(None, table, 'genres', ['genre_id'], ['id'], ondelete='cascade')
+        op.create_index(f'ix_{table}_genre_id', table, ['genre_id'], unique=False)
+
+
+def downgrade():
+    for table, owner_column in OWNERS:
+        op.drop_index(f'ix_{table}_genre_id', table_name=table)
+        op.drop_constraint(f'{table}_genre_id_fkey', table, type_='foreignkey')
+        op.drop_constraint(f'{table}_pkey', table, type_='primary')
+        op.add_column(table, sa.Column('name', sa.String(), nullable=True))
+        op.execute(f'UPDATE {table} SET name = genres.name FROM genres WHERE genres.id = {table}.genre_id')
+        op.alter_column(table, 'name', existing_type=sa.String(), nullable=False)
+        op.drop_column(table, 'genre_id')
+        op.execute(f'ALTER TABLE {table} ADD COLUMN id SERIAL')
+        op.create_primary_key(f'{table}_pkey', table, ['id'])
+        op.create_index(f'ix_{table}_{owner_column}', table, [owner_column], unique=False)
+    op.drop_table('genres')
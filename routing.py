@@ -0,0 +1,27 @@
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import orm
+from sqlalchemy.sql.dml import UpdateBase
+
+# Session that sends reads to a replica when the application says it may
+
+
+class RoutingSession(SignallingSession):
+    def __init__(self, db, **options):
+        self.db = db
+        super(RoutingSession, self).__init__(db, **options)
+
+    def get_bind(self, mapper=None, clause=None):
+        # flushes and INSERT/UPDATE/DELETE statements always go to the primary
+        if not self._flushing and not isinstance(clause, UpdateBase) and self.db.replica_selector is not None:
+            replica = self.db.replica_selector()
+            if replica is not None:
+                return replica
+        return super(RoutingSession, self).get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    # replica_selector returns the engine to read from, or None for the primary
+    replica_selector = None
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
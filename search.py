@@ -0,0 +1,73 @@
+import threading
+from collections import defaultdict
+
+# In-process n-gram index used for name search when the database has no
+# trigram support (e.g. SQLite during development)
+
+
+def ngrams(text, n=3):
+    text = text.lower()
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+class NGramIndex(object):
+    def __init__(self, n=3):
+        self.n = n
+        self.built = False
+        self._names = {}
+        self._postings = defaultdict(set)
+        self._lock = threading.RLock()
+
+    def build(self, rows):
+        with self._lock:
+            self.clear()
+            for doc_id, name in rows:
+                self.add(doc_id, name)
+            self.built = True
+
+    def clear(self):
+        with self._lock:
+            self.built = False
+            self._names = {}
+            self._postings = defaultdict(set)
+
+    def add(self, doc_id, name):
+        with self._lock:
+            self.remove(doc_id)
+            self._names[doc_id] = name
+            for gram in ngrams(name, self.n):
+                self._postings[gram].add(doc_id)
+
+    def remove(self, doc_id):
+        with self._lock:
+            name = self._names.pop(doc_id, None)
+            if name is None:
+                return
+            for gram in ngrams(name, self.n):
+                postings = self._postings.get(gram)
+                if postings is not None:
+                    postings.discard(doc_id)
+                    if not postings:
+                        del self._postings[gram]
+
+    def search(self, term):
+        # returns the ids of every name containing term (case-insensitive),
+        # best matches first
+        term = term.lower()
+        term_grams = ngrams(term, self.n)
+        with self._lock:
+            if term_grams:
+                postings = sorted((self._postings.get(gram, set()) for gram in term_grams), key=len)
+                candidates = set.intersection(*postings)
+            else:
+                candidates = self._names.keys()
+            matches = [(doc_id, self._names[doc_id]) for doc_id in candidates
+                       if term in self._names[doc_id].lower()]
+        return [doc_id for doc_id, name in sorted(
+            matches, key=lambda match: (-self.similarity(term_grams, match[1]), match[0]))]
+
+    def similarity(self, term_grams, name):
+        name_grams = ngrams(name, self.n)
+        if not term_grams or not name_grams:
+            return 0.0
+        return len(term_grams & name_grams) / len(term_grams | name_grams)
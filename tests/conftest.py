@@ -0,0 +1,38 @@
+import os
+import tempfile
+
+import pytest
+
+# The app reads its configuration on import: the tests run it against a scratch
+# SQLite file (a file, so that threads share it), without replicas or metrics files
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'test.db')
+os.environ.pop('DATABASE_REPLICA_URLS', None)
+os.environ.pop('METRICS_DIR', None)
+
+import app as fyyur  # noqa: E402
+from forms import genre_choices  # noqa: E402
+
+fyyur.app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+
+
+@pytest.fixture
+def database():
+    # empty tables holding the form's genres, caches and in-process indexes cleared.
+    # Tests reach the database in their own `with app.app_context()` blocks: a request
+    # made while an app context is pushed reuses it, and its g, instead of getting a fresh one
+    genre_names = [name for name, label in genre_choices]
+    with fyyur.app.app_context():
+        fyyur.db.drop_all()
+        fyyur.db.create_all()
+        fyyur.db.session.execute(fyyur.Genre.__table__.insert().values([{'name': name} for name in genre_names]))
+        fyyur.db.session.commit()
+        fyyur.loadGenres()
+    fyyur.cache.clear()
+    for search_index in fyyur.search_indexes.values():
+        search_index.clear()
+    return fyyur.db
+
+
+@pytest.fixture
+def client(database):
+    return fyyur.app.test_client()
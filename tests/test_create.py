@@ -0,0 +1,41 @@
+import threading
+
+import app as fyyur
+from forms import genre_choices
+
+
+def test_parallel_creates_attach_genres_to_their_own_entity(database):
+    # each thread creates venues and artists with its own genres, every new row must
+    # end up with exactly the genres its form was posted with
+    genre_names = [name for name, label in genre_choices]
+    submitted = {}
+    errors = []
+
+    def create(worker):
+        client = fyyur.app.test_client()
+        for number in range(5):
+            name = f'Worker {worker} number {number}'
+            genres = genre_names[(worker + number) % len(genre_names):][:1 + (worker + number) % 4]
+            submitted[name] = sorted(genres)
+            for url, data in (('/venues/create', {'address': '1 Main St'}), ('/artists/create', {})):
+                response = client.post(url, data=dict(data, name=name, city='Austin', state='TX', genres=genres,
+                                                      website='http://example.com', facebook_link='http://example.com'))
+                if response.status_code != 200 or b'could not be listed' in response.data:
+                    errors.append((url, name))
+
+    threads = [threading.Thread(target=create, args=(worker,)) for worker in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    with fyyur.app.app_context():
+        for model, genre_model, owner_column in ((fyyur.Venue, fyyur.VenueGenre, 'venue_id'),
+                                                 (fyyur.Artist, fyyur.ArtistGenre, 'artist_id')):
+            created = {name: entity_id for entity_id, name in database.session.query(model.id, model.name)}
+            assert set(created) == set(submitted)
+            for name, entity_id in created.items():
+                genre_ids = [genre_id for (genre_id,) in database.session.query(genre_model.genre_id).
+                             filter(getattr(genre_model, owner_column) == entity_id)]
+                assert sorted(fyyur.genreNames(genre_ids)) == submitted[name], name
@@ -0,0 +1,45 @@
+import app as fyyur
+
+
+def venueGenres(venue_id):
+    with fyyur.app.app_context():
+        return sorted(fyyur.genreNames(row.genre_id for row in fyyur.VenueGenre.query.filter_by(venue_id=venue_id)))
+
+
+def artistGenres(artist_id):
+    with fyyur.app.app_context():
+        return sorted(fyyur.genreNames(row.genre_id for row in fyyur.ArtistGenre.query.filter_by(artist_id=artist_id)))
+
+
+def test_venue_edit_removes_genre_from_that_venue_only(database, client):
+    with fyyur.app.app_context():
+        venues = [fyyur.Venue(name=name, city='San Francisco', state='CA', address='1 Main St') for name in ('Blue Hall', 'Red Hall')]
+        database.session.add_all(venues)
+        database.session.flush()
+        fyyur.insertGenres(fyyur.VenueGenre, 'venue_id', [(venue.id, ['Jazz', 'Blues']) for venue in venues])
+        database.session.commit()
+        edited, other = [venue.id for venue in venues]
+
+    response = client.post(f'/venues/{edited}/edit', data={'name': 'Blue Hall', 'city': 'San Francisco', 'state': 'CA',
+                                                           'address': '1 Main St', 'genres': ['Jazz'], 'version': '1'})
+
+    assert response.status_code == 302
+    assert venueGenres(edited) == ['Jazz']
+    assert venueGenres(other) == ['Blues', 'Jazz']
+
+
+def test_artist_edit_removes_genre_from_that_artist_only(database, client):
+    with fyyur.app.app_context():
+        artists = [fyyur.Artist(name=name, city='San Francisco', state='CA') for name in ('Guns N Petals', 'Matt Quevedo')]
+        database.session.add_all(artists)
+        database.session.flush()
+        fyyur.insertGenres(fyyur.ArtistGenre, 'artist_id', [(artist.id, ['Jazz', 'Blues']) for artist in artists])
+        database.session.commit()
+        edited, other = [artist.id for artist in artists]
+
+    response = client.post(f'/artists/{edited}/edit', data={'name': 'Guns N Petals', 'city': 'San Francisco', 'state': 'CA',
+                                                            'genres': ['Blues', 'Folk'], 'version': '1'})
+
+    assert response.status_code == 302
+    assert artistGenres(edited) == ['Blues', 'Folk']
+    assert artistGenres(other) == ['Blues', 'Jazz']
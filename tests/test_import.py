@@ -0,0 +1,40 @@
+import app as fyyur
+
+
+def artistRow(seeking_venue):
+    return {'name': 'Guns N Petals', 'city': 'San Francisco', 'state': 'CA', 'genres': ['Rock n Roll'],
+            'website': 'https://www.gunsnpetalsband.com', 'facebook_link': 'https://www.facebook.com/GunsNPetals',
+            'seeking_venue': seeking_venue}
+
+
+def test_csv_flags_spelled_false_import_as_false(database):
+    with fyyur.app.test_request_context():
+        for value in ('False', 'false', '0', 'no', '', False):
+            data, errors = fyyur.validateImportRow(fyyur.ArtistForm, artistRow(value))
+            assert errors is None
+            assert data['seeking_venue'] is False, value
+        for value in ('True', 'y', '1', True):
+            data, errors = fyyur.validateImportRow(fyyur.ArtistForm, artistRow(value))
+            assert data['seeking_venue'] is True, value
+
+
+def test_show_rows_naming_unknown_venues_or_artists_are_rejected(database, tmp_path):
+    with fyyur.app.app_context():
+        venue = fyyur.Venue(name='The Musical Hop', city='San Francisco', state='CA', address='1015 Folsom Street')
+        artist = fyyur.Artist(name='Guns N Petals', city='San Francisco', state='CA')
+        database.session.add_all([venue, artist])
+        database.session.commit()
+        venue_id, artist_id = venue.id, artist.id
+    rows = [f'{{"venue_id": {venue_id}, "artist_id": {artist_id}, "start_time": "2035-01-01 20:00:00"}}',
+            f'{{"venue_id": {venue_id}, "artist_id": 999, "start_time": "2035-01-02 20:00:00"}}',
+            f'{{"venue_id": 999, "artist_id": {artist_id}, "start_time": "2035-01-03 20:00:00"}}']
+    path = tmp_path / 'shows.ndjson'
+    path.write_text('\n'.join(rows) + '\n')
+
+    result = fyyur.app.test_cli_runner(mix_stderr=False).invoke(args=['import', 'shows', str(path)])
+
+    assert result.exit_code == 0, result.output
+    assert 'row 2 rejected' in result.stderr and 'row 3 rejected' in result.stderr
+    assert '1 imported, 2 rejected' in result.output
+    with fyyur.app.app_context():
+        assert [(show.venue_id, show.artist_id) for show in fyyur.Show.query] == [(venue_id, artist_id)]
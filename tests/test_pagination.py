@@ -0,0 +1,28 @@
+import base64
+import json
+
+import app as fyyur
+
+
+def encode(value):
+    return base64.urlsafe_b64encode(json.dumps(value).encode()).decode()
+
+
+def test_listing_pages_follow_their_cursor(database, client):
+    with fyyur.app.app_context():
+        database.session.add_all([fyyur.Artist(name=f'Artist {number}', city='Austin', state='TX') for number in range(5)])
+        database.session.commit()
+
+    first = client.get('/artists?limit=3')
+    after = fyyur.encodeCursor([3])
+
+    assert first.status_code == 200 and after in first.get_data(as_text=True)
+    second = client.get(f'/artists?limit=3&after={after}').get_data(as_text=True)
+    assert 'Artist 3' in second and 'Artist 4' in second and 'Artist 2' not in second
+
+
+def test_malformed_cursors_are_bad_requests(database, client):
+    # the venue listing orders by (state, city, id)
+    for cursor in ('not base64!', encode([1]), encode(['CA', 'San Francisco', 1, 2]), encode({'state': 'CA', 'city': 'x', 'id': 1}),
+                   encode('CA')):
+        assert client.get(f'/venues?after={cursor}').status_code == 400, cursor
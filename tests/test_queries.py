@@ -0,0 +1,55 @@
+import re
+from datetime import datetime, timedelta
+
+import pytest
+
+import app as fyyur
+
+
+def statementCount(response):
+    return int(re.search(r'db;[^,]*desc="(\d+) statements', response.headers['Server-Timing']).group(1))
+
+
+def test_lazy_genre_loads_in_a_loop_raise_n_plus_one(database):
+    with fyyur.app.app_context():
+        venues = [fyyur.Venue(name=f'Hall {number}', city='Austin', state='TX', address='1 Main St') for number in range(8)]
+        database.session.add_all(venues)
+        database.session.flush()
+        fyyur.insertGenres(fyyur.VenueGenre, 'venue_id', [(venue.id, ['Jazz']) for venue in venues])
+        database.session.commit()
+
+    with fyyur.app.test_request_context('/venues'):
+        fyyur.app.preprocess_request()
+        with pytest.raises(fyyur.NPlusOneQuery):
+            for venue in fyyur.Venue.query.all():
+                venue.genres
+
+
+def test_detail_pages_stay_within_their_statement_budget(database, client, monkeypatch):
+    now = datetime.now()
+    with fyyur.app.app_context():
+        venue = fyyur.Venue(name='Blue Hall', city='Austin', state='TX', address='1 Main St')
+        artists = [fyyur.Artist(name=f'Artist {number}', city='Austin', state='TX') for number in range(2)]
+        database.session.add_all([venue] + artists)
+        database.session.flush()
+        fyyur.insertGenres(fyyur.VenueGenre, 'venue_id', [(venue.id, ['Jazz', 'Blues'])])
+        fyyur.insertGenres(fyyur.ArtistGenre, 'artist_id', [(artist.id, ['Folk']) for artist in artists])
+        database.session.add_all([fyyur.Show(venue_id=venue.id, artist_id=artist.id, start_time=now + timedelta(days=days))
+                                  for artist in artists for days in (-30, 30)])
+        database.session.commit()
+        venue_id, artist_id = venue.id, artists[0].id
+
+    for path in (f'/venues/{venue_id}', f'/artists/{artist_id}'):
+        response = client.get(path)
+        assert response.status_code == 200, path
+        assert statementCount(response) <= 3, path
+
+    # one extra query per show (four, under the N+1 threshold) must trip the budget rather than pass silently
+    queryVenueShows = fyyur.queryVenueShows
+    def queryVenueShowsOneByOne(venue_id):
+        rows = queryVenueShows(venue_id).all()
+        return [row for row in rows if fyyur.db.session.query(fyyur.Artist.name).filter_by(id=row.id).scalar()]
+    monkeypatch.setattr(fyyur, 'queryVenueShows', queryVenueShowsOneByOne)
+    fyyur.cache.clear()
+    with pytest.raises(AssertionError, match='the budget is 3'):
+        client.get(f'/venues/{venue_id}')
@@ -0,0 +1,56 @@
+import os
+
+import pytest
+from flask_sqlalchemy import get_state
+
+import app as fyyur
+
+
+@pytest.fixture
+def replica(database, tmp_path, monkeypatch):
+    # a second SQLite file as the only replica, with the same tables and genres but its own
+    # venues; yields the (primary, replica) engines
+    monkeypatch.setitem(fyyur.app.config, 'SQLALCHEMY_BINDS', {'replica_0': 'sqlite:///' + os.path.join(tmp_path, 'replica.db')})
+    monkeypatch.setattr(fyyur, 'REPLICA_BINDS', ['replica_0'])
+    with fyyur.app.app_context():
+        primary = database.engine
+        engine = database.get_engine(fyyur.app, bind='replica_0')
+    database.Model.metadata.create_all(engine)
+    engine.execute(fyyur.Genre.__table__.insert(), [dict(row) for row in primary.execute(fyyur.Genre.__table__.select())])
+    yield primary, engine
+    engine.dispose()
+    get_state(fyyur.app).connectors.pop('replica_0', None)
+
+
+def addVenue(connection, name):
+    connection.execute(fyyur.Venue.__table__.insert().values(id=1, name=name, city='San Francisco', state='CA', address='1 Main St'))
+
+
+def venueName(connection):
+    return connection.execute(fyyur.db.select([fyyur.Venue.name]).where(fyyur.Venue.id == 1)).scalar()
+
+
+def test_reads_go_to_the_replica_writes_and_the_writers_next_reads_to_the_primary(replica, client):
+    primary, replica = replica
+    addVenue(primary, 'Primary Hall')
+    addVenue(replica, 'Replica Hall')
+
+    page = client.get('/venues/1').get_data(as_text=True)
+    assert 'Replica Hall' in page and 'Primary Hall' not in page
+
+    response = client.post('/venues/1/edit', data={'name': 'Edited Hall', 'city': 'San Francisco', 'state': 'CA',
+                                                   'address': '1 Main St', 'version': '1'})
+    assert response.status_code == 302
+    assert 'read_primary=1' in response.headers['Set-Cookie']
+    assert venueName(primary) == 'Edited Hall'
+    assert venueName(replica) == 'Replica Hall'
+
+    # the client keeps the cookie, the page the edit redirects to reads the primary
+    page = client.get(response.headers['Location']).get_data(as_text=True)
+    assert 'Edited Hall' in page
+
+    # without the cookie, and past the page cache, reads are back on the replica
+    client.cookie_jar.clear()
+    fyyur.cache.clear()
+    page = client.get('/venues/1').get_data(as_text=True)
+    assert 'Replica Hall' in page